@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+from threading import Lock
+import config_manager
+
+# Page analyses are paid API calls; their results are kept on disk, keyed by the content that
+# produced them, so re-uploads, retries and the same handout in several years cost nothing.
+# Beyond ANALYSIS_CACHE_MAX_BYTES of results, the least recently used ones are evicted.
+ANALYSIS_CACHE_FILENAME = 'gemini_analysis_cache.db'
+ANALYSIS_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS analysis (
+    key TEXT PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL
+)"""
+
+def content_hash(data):
+    """Hash of page text (str) or page bytes, for cache keys."""
+    if isinstance(data, str): data = data.encode('utf-8')
+    return hashlib.blake2b(data or b'', digest_size=16).hexdigest()
+
+def cache_key(kind, model, prompt_version, *parts):
+    """Key of one analysis: what was asked (kind, model, prompt version) of which content (parts)."""
+    return hashlib.blake2b(json.dumps([kind, model, prompt_version, *parts]).encode('utf-8'), digest_size=16).hexdigest()
+
+class AnalysisCache:
+    """Persistent, size-bounded LRU mapping of cache keys to Gemini analysis results, in one SQLite file."""
+
+    def __init__(self, path, max_bytes=ANALYSIS_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._ready = False
+
+    def _connect(self):
+        if not self._ready: os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(_SCHEMA)
+            self._ready = True
+        return conn
+
+    def get(self, key):
+        """Returns the cached result for key, or None."""
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    row = conn.execute("SELECT result FROM analysis WHERE key = ?", (key,)).fetchone()
+                    if row is None:
+                        self.misses += 1
+                        return None
+                    with conn: conn.execute("UPDATE analysis SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self.hits += 1
+                    return row[0]
+                finally:
+                    conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read analysis cache {self.path}: {e}")
+            return None
+
+    def put(self, key, result):
+        try:
+            with self._lock:
+                conn = self._connect()
+                try:
+                    with conn:
+                        conn.execute("INSERT OR REPLACE INTO analysis (key, result, size, last_used) VALUES (?, ?, ?, ?)",
+                                     (key, result, len(result.encode('utf-8')), time.time()))
+                        self._evict(conn)
+                finally:
+                    conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write analysis cache {self.path}: {e}")
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM analysis").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in conn.execute("SELECT key, size FROM analysis ORDER BY last_used"):
+            if total <= self.max_bytes: break
+            evicted.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM analysis WHERE key = ?", evicted)
+        logging.info(f"Evicted {len(evicted)} analyses from the analysis cache.")
+
+    def purge(self):
+        """Deletes every cached result. Returns {'entries', 'bytes'} removed."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis").fetchone()
+                    conn.execute("DELETE FROM analysis")
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+        logging.info(f"Purged {entries} analyses ({size} bytes) from the analysis cache.")
+        return {'entries': entries, 'bytes': size}
+
+    def stats(self):
+        with self._lock:
+            conn = self._connect()
+            try:
+                entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis").fetchone()
+            finally:
+                conn.close()
+            return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+_shared_cache = None
+_shared_cache_lock = Lock()
+
+def get_analysis_cache():
+    """Returns the process-wide analysis cache in the app data directory, shared by every year repository."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = AnalysisCache(os.path.join(config_manager.APP_DATA_DIR, ANALYSIS_CACHE_FILENAME))
+        return _shared_cache
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from threading import Lock, Thread
+
+# Ingestion runs as coroutines on one process-wide event loop in a background thread: every
+# upload's pages wait on the Gemini governor there without holding a thread each. At most
+# INGEST_CONCURRENCY pages (or video segments) of one upload are in progress at once; the
+# governor still caps the requests actually in flight across the process.
+INGEST_CONCURRENCY = 64
+
+_ingest_loop = None
+_ingest_loop_lock = Lock()
+
+def get_ingest_loop():
+    """Returns the shared ingestion event loop, starting its thread on first use."""
+    global _ingest_loop
+    with _ingest_loop_lock:
+        if _ingest_loop is None:
+            _ingest_loop = asyncio.new_event_loop()
+            Thread(target=_ingest_loop.run_forever, name='ingest-loop', daemon=True).start()
+            logging.info("Started the ingestion event loop.")
+        return _ingest_loop
+
+def iterate_async(async_iterable):
+    """Iterates an async generator on the ingestion loop from synchronous code, e.g. an upload thread."""
+    loop = get_ingest_loop()
+    iterator = async_iterable.__aiter__()
+    try:
+        while True:
+            try:
+                item = asyncio.run_coroutine_threadsafe(iterator.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        # Stops the generator (and the work it started) if the caller gave up early.
+        asyncio.run_coroutine_threadsafe(iterator.aclose(), loop).result()
+
+async def map_unordered(worker, jobs, limit=INGEST_CONCURRENCY):
+    """Awaits worker(job) for every job, at most limit at once, yielding (job, result, error) as each finishes."""
+    semaphore = asyncio.BoundedSemaphore(limit)
+
+    async def run(job):
+        async with semaphore:
+            try:
+                return job, await worker(job), None
+            except Exception as e:
+                return job, None, e
+
+    tasks = [asyncio.ensure_future(run(job)) for job in jobs]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks: task.cancel()
@@ -0,0 +1,296 @@
+"""Measures build time, on-disk size, search latency and recall of the vector index layouts.
+
+Corpora are synthetic: clustered unit vectors standing in for cached page embeddings, with
+page metadata spread over documents and doc types like a real library. Each layout is built
+and searched through the same functions VectorDatabase uses, and recall@k is measured against
+an exact search over the same (filtered) pages. Results are written as JSON, e.g.
+
+    python benchmark.py --sizes 1000 10000 --layouts flat ivf_flat hnsw ivf_flat+sq8+rescore --output bench.json
+
+With --mode database, each layout is instead a real VectorDatabase over a synthetic library.db,
+embedded with the hashing embedder and built with build_full_index, and the timings are of
+search() end to end: query encoding, filtering, duplicate grouping and reading page text. Every
+(query, filter) pair is searched once per layout, so the result cache is always cold.
+
+Sizes are of the files as written to disk, not of the memory a process ends up holding.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import logging
+import platform
+import tempfile
+import numpy as np
+import faiss
+from sqlalchemy import create_engine
+from models import PDFDocument, PDFPage
+from page_metadata import PageMetadataStore
+from embedders import get_embedder
+from vector_db import VectorDatabase, target_layout, create_faiss_index, index_layout, search_index, IVF_MAX_TRAINING_VECTORS
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+DEFAULT_LAYOUTS = ('flat', 'ivf_flat', 'ivf_flat+sq8+rescore', 'ivf_pq', 'hnsw')
+# Every index type, quantization and rescore combination; '--layouts all' runs each of them
+# through the unfiltered and filtered searches, as a smoke test of the search paths.
+ALL_LAYOUTS = ('flat', 'flat+sq8', 'flat+sq8+rescore', 'flat+pq', 'flat+pq+rescore',
+               'ivf_flat', 'ivf_flat+sq8', 'ivf_flat+sq8+rescore', 'ivf_pq', 'ivf_pq+rescore',
+               'hnsw', 'hnsw+sq8', 'hnsw+sq8+rescore', 'hnsw+pq', 'hnsw+pq+rescore')
+DEFAULT_DIMENSION = 384
+PAGES_PER_DOCUMENT = 50
+CLUSTERS_PER_1K_PAGES = 4
+YOUTUBE_SHARE = 0.25 # pages from 'youtube' documents, the doc_type filter of the benchmark
+FILTER_DOCUMENTS = 5 # documents selected by the document_ids filter
+ADD_BATCH_SIZE = 65536
+# Synthetic page text for --mode database: each cluster draws TOPIC_SHARE of its words from its
+# own TOPIC_WORDS, the rest from the whole vocabulary; queries are QUERY_WORDS words of a page.
+VOCABULARY_SIZE = 20000
+TOPIC_WORDS = 40
+TOPIC_SHARE = 0.6
+WORDS_PER_PAGE = 80
+QUERY_WORDS = 6
+
+def parse_layout(spec):
+    """Turns 'ivf_flat+sq8+rescore' into ('ivf_flat', 'sq8', True)."""
+    parts = spec.split('+')
+    quantization = next((part for part in parts[1:] if part in ('sq8', 'pq')), 'none')
+    return parts[0], quantization, 'rescore' in parts[1:]
+
+def make_corpus(num_pages, dimension, seed):
+    """Returns (ids, vectors, pages) for a synthetic library of num_pages pages."""
+    rng = np.random.default_rng(seed)
+    num_clusters = max(1, num_pages * CLUSTERS_PER_1K_PAGES // 1000)
+    centers = rng.standard_normal((num_clusters, dimension)).astype('float32')
+    vectors = np.empty((num_pages, dimension), dtype='float32')
+    for start in range(0, num_pages, ADD_BATCH_SIZE):
+        end = min(start + ADD_BATCH_SIZE, num_pages)
+        chunk = centers[rng.integers(num_clusters, size=end - start)] + rng.standard_normal((end - start, dimension)).astype('float32')
+        vectors[start:end] = chunk / np.linalg.norm(chunk, axis=1, keepdims=True)
+    # Page ids start at 1 and have gaps, like rows of a library that saw deletions.
+    ids = np.cumsum(rng.integers(1, 3, size=num_pages)).astype(np.int64)
+    num_documents = max(1, num_pages // PAGES_PER_DOCUMENT)
+    document_ids = np.minimum(np.arange(num_pages) // PAGES_PER_DOCUMENT, num_documents - 1) + 1
+    youtube = rng.random(num_documents) < YOUTUBE_SHARE
+    pages = PageMetadataStore()
+    pages.upsert([{
+        'id': int(page_id), 'document_id': int(document_id), 'page_number': i % PAGES_PER_DOCUMENT + 1,
+        'document_name': f"document_{document_id}", 'doc_type': 'youtube' if youtube[document_id - 1] else 'pdf',
+        'start_time_seconds': None,
+    } for i, (page_id, document_id) in enumerate(zip(ids, document_ids))])
+    return ids, vectors, pages
+
+def make_library(path, num_pages, seed):
+    """Writes library.db under path with num_pages analyzed pages of synthetic text.
+
+    Returns (ids, texts, pages): the page ids, their ENHANCED_TEXT and their metadata.
+    """
+    rng = np.random.default_rng(seed)
+    num_clusters = max(1, num_pages * CLUSTERS_PER_1K_PAGES // 1000)
+    topics = rng.integers(VOCABULARY_SIZE, size=(num_clusters, TOPIC_WORDS))
+    num_documents = max(1, num_pages // PAGES_PER_DOCUMENT)
+    youtube = rng.random(num_documents) < YOUTUBE_SHARE
+    documents = [{'id': d + 1, 'user_id': 1, 'filename': f"document_{d + 1}", 'original_filename': f"document_{d + 1}",
+                  'file_path': '', 'doc_type': 'youtube' if youtube[d] else 'pdf', 'processed': True} for d in range(num_documents)]
+    texts, rows = [], []
+    for i in range(num_pages):
+        topic = topics[rng.integers(num_clusters)]
+        words = np.where(rng.random(WORDS_PER_PAGE) < TOPIC_SHARE, topic[rng.integers(TOPIC_WORDS, size=WORDS_PER_PAGE)],
+                         rng.integers(VOCABULARY_SIZE, size=WORDS_PER_PAGE))
+        texts.append(' '.join(f"w{word}" for word in words))
+        rows.append({'id': i + 1, 'document_id': min(i // PAGES_PER_DOCUMENT, num_documents - 1) + 1, 'page_number': i % PAGES_PER_DOCUMENT + 1,
+                     'gemini_analysis': f"###TITLE###\nPage {i + 1}\n###ENHANCED_TEXT###\n{texts[-1]}\n###QUESTIONS###\n"})
+    engine = create_engine(f"sqlite:///{os.path.join(path, 'library.db')}")
+    try:
+        PDFDocument.__table__.create(engine)
+        PDFPage.__table__.create(engine)
+        with engine.begin() as conn:
+            conn.execute(PDFDocument.__table__.insert(), documents)
+            conn.execute(PDFPage.__table__.insert(), rows)
+    finally:
+        engine.dispose()
+    pages = PageMetadataStore()
+    pages.upsert([{'id': row['id'], 'document_id': row['document_id'], 'page_number': row['page_number'],
+                   'document_name': f"document_{row['document_id']}", 'doc_type': documents[row['document_id'] - 1]['doc_type'],
+                   'start_time_seconds': None} for row in rows])
+    return pages.ids().copy(), texts, pages
+
+def make_text_queries(texts, num_queries, seed):
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for page in rng.integers(len(texts), size=num_queries):
+        words = texts[page].split()
+        queries.append(' '.join(words[j] for j in rng.choice(len(words), size=min(QUERY_WORDS, len(words)), replace=False)))
+    return queries
+
+def make_queries(vectors, num_queries, seed):
+    # Perturbed corpus vectors, so queries land where the pages are, as real questions do.
+    rng = np.random.default_rng(seed + 1)
+    queries = vectors[rng.integers(len(vectors), size=num_queries)] + 0.5 * rng.standard_normal((num_queries, vectors.shape[1])).astype('float32') / np.sqrt(vectors.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype('float32')
+
+def make_filters(pages, seed):
+    """Returns {name: allowed page ids or None} for the filters a search can apply."""
+    rng = np.random.default_rng(seed + 2)
+    document_ids = np.unique(pages.records['document_id'])
+    chosen = rng.choice(document_ids, size=min(FILTER_DOCUMENTS, len(document_ids)), replace=False)
+    return {
+        'unfiltered': None,
+        'doc_type': pages.select_ids(doc_type='youtube'),
+        'document_ids': pages.select_ids(document_ids=chosen.tolist()),
+    }
+
+def exact_neighbours(ids, vectors, queries, k, allowed_ids):
+    if allowed_ids is not None:
+        mask = np.isin(ids, allowed_ids)
+        ids, vectors = ids[mask], vectors[mask]
+    k = min(k, len(ids))
+    if k == 0:
+        return np.empty((len(queries), 0), dtype=np.int64)
+    _, positions = faiss.knn(queries, vectors, k)
+    return ids[positions]
+
+def percentiles(samples_ms):
+    p50, p95, p99 = np.percentile(samples_ms, [50, 95, 99])
+    return {'p50_ms': round(float(p50), 4), 'p95_ms': round(float(p95), 4), 'p99_ms': round(float(p99), 4), 'mean_ms': round(float(np.mean(samples_ms)), 4)}
+
+def recall_at_k(found, expected):
+    hits = [len(set(f[f != -1].tolist()) & set(e.tolist())) / len(e) for f, e in zip(found, expected) if len(e)]
+    return round(float(np.mean(hits)), 4) if hits else None
+
+def benchmark_layout(spec, ids, vectors, pages, queries, filters, truth, k):
+    layout = target_layout(*parse_layout(spec), len(ids))
+    start = time.perf_counter()
+    training = vectors
+    if len(vectors) > IVF_MAX_TRAINING_VECTORS:
+        training = vectors[np.sort(np.random.default_rng(0).choice(len(vectors), IVF_MAX_TRAINING_VECTORS, replace=False))]
+    index = create_faiss_index(vectors.shape[1], layout, training)
+    train_seconds = time.perf_counter() - start
+    for batch in range(0, len(ids), ADD_BATCH_SIZE):
+        index.add_with_ids(vectors[batch:batch + ADD_BATCH_SIZE], ids[batch:batch + ADD_BATCH_SIZE])
+    build_seconds = time.perf_counter() - start
+
+    result = {
+        'layout': spec, 'resolved_layout': list(layout),
+        'build_seconds': round(build_seconds, 4), 'train_seconds': round(train_seconds, 4),
+        # The serialized sizes, i.e. of the files a snapshot writes.
+        'index_disk_bytes': int(faiss.serialize_index(index).nbytes), 'page_metadata_disk_bytes': int(pages.records.nbytes),
+        'searches': {},
+    }
+    for name, allowed_ids in filters.items():
+        latencies, found = [], []
+        for query in queries:
+            # One query at a time, as a chat message or search page issues them.
+            started = time.perf_counter()
+            _, labels = search_index(index, query[None, :], k, allowed_ids)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found.append(labels[0])
+        result['searches'][name] = {
+            'allowed_pages': len(ids) if allowed_ids is None else int(len(allowed_ids)),
+            f'recall@{k}': recall_at_k(found, truth[name]), **percentiles(latencies),
+        }
+    return result
+
+def benchmark_database(spec, library_path, work_dir, queries, filters, truth, k):
+    path = os.path.join(work_dir, spec)
+    os.makedirs(path)
+    shutil.copy(library_path, os.path.join(path, 'library.db'))
+    index_type, quantization, rescore = parse_layout(spec)
+    start = time.perf_counter()
+    database = VectorDatabase(path, index_type=index_type, quantization=quantization, rescore=rescore, embedder='hashing',
+                              encode_processes=1, collapse_duplicates=False)
+    database.build_full_index()
+    build_seconds = time.perf_counter() - start
+
+    result = {
+        'layout': spec, 'resolved_layout': list(index_layout(database.faiss_index)), 'build_seconds': round(build_seconds, 4),
+        'index_disk_bytes': sum(os.path.getsize(p) for p in database.index_file_paths() if os.path.exists(p)),
+        'searches': {},
+    }
+    for name, (search_filter, allowed_ids) in filters.items():
+        latencies, found = [], []
+        for query in queries:
+            started = time.perf_counter()
+            results = database.search(query, k, **search_filter)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found.append(np.array([r['page_id'] for r in results], dtype=np.int64))
+        result['searches'][name] = {
+            'allowed_pages': len(database.pages) if allowed_ids is None else int(len(allowed_ids)),
+            f'recall@{k}': recall_at_k(found, truth[name]), **percentiles(latencies),
+        }
+    return result
+
+def run_database(size, layouts, num_queries, k, seed):
+    """Benchmarks search() of a VectorDatabase per layout over one synthetic library of size pages."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix='vector-benchmark-') as work_dir:
+        logging.info(f"Generating a library of {size} pages...")
+        ids, texts, pages = make_library(work_dir, size, seed)
+        queries = make_text_queries(texts, num_queries, seed)
+        embedder = get_embedder('hashing')
+        vectors, query_vectors = embedder.encode(texts), embedder.encode(queries)
+        filters = make_filters(pages, seed)
+        chosen = np.unique(pages.records['document_id'][np.isin(pages.ids(), filters['document_ids'])])
+        search_filters = {
+            'unfiltered': ({}, None),
+            'doc_type': ({'content_type_filter': 'youtube'}, filters['doc_type']),
+            'document_ids': ({'document_ids': chosen.tolist()}, filters['document_ids']),
+        }
+        truth = {name: exact_neighbours(ids, vectors, query_vectors, k, allowed_ids) for name, (_, allowed_ids) in search_filters.items()}
+        for spec in layouts:
+            logging.info(f"Benchmarking a {spec} VectorDatabase on {size} pages...")
+            results.append({'pages': size, **benchmark_database(spec, os.path.join(work_dir, 'library.db'), work_dir, queries, search_filters, truth, k)})
+    return results
+
+def run(sizes, layouts, num_queries, k, dimension, seed, mode='index'):
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'faiss': faiss.__version__,
+                        'machine': platform.machine(), 'faiss_threads': faiss.omp_get_max_threads()},
+        'parameters': {'mode': mode, 'sizes': list(sizes), 'layouts': list(layouts), 'queries': num_queries, 'k': k,
+                       'dimension': dimension, 'seed': seed},
+        'results': [],
+    }
+    for size in sizes:
+        if mode == 'database':
+            report['results'].extend(run_database(size, layouts, num_queries, k, seed))
+            continue
+        logging.info(f"Generating a corpus of {size} pages...")
+        ids, vectors, pages = make_corpus(size, dimension, seed)
+        queries = make_queries(vectors, num_queries, seed)
+        filters = make_filters(pages, seed)
+        truth = {name: exact_neighbours(ids, vectors, queries, k, allowed_ids) for name, allowed_ids in filters.items()}
+        for spec in layouts:
+            logging.info(f"Benchmarking {spec} on {size} pages...")
+            report['results'].append({'pages': size, **benchmark_layout(spec, ids, vectors, pages, queries, filters, truth, k)})
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark vector index layouts on synthetic corpora.")
+    parser.add_argument('--mode', choices=('index', 'database'), default='index',
+                        help="time search_index on bare indexes, or search() of a VectorDatabase with the hashing embedder")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="corpus sizes in pages")
+    parser.add_argument('--layouts', nargs='+', default=list(DEFAULT_LAYOUTS),
+                        help="index_type[+sq8|+pq][+rescore], e.g. flat, ivf_flat+sq8+rescore, hnsw; or 'all'")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--dimension', type=int, default=DEFAULT_DIMENSION, help="vector size of --mode index")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=None, help="FAISS OpenMP threads (default: all cores)")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.threads: faiss.omp_set_num_threads(args.threads)
+    layouts = ALL_LAYOUTS if args.layouts == ['all'] else args.layouts
+    report = run(args.sizes, layouts, args.queries, args.k, args.dimension, args.seed, args.mode)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(output)
+        logging.info(f"Wrote benchmark report to {args.output}")
+    else:
+        sys.stdout.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
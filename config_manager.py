@@ -41,3 +41,23 @@ def load_user_year():
 
 def is_admin():
     return _load_config().get('is_admin', False)
+
+def load_gemini_limits():
+    """Returns the configured (requests per minute, concurrent requests) for the Gemini API; None where unset."""
+    config = _load_config()
+    return config.get('gemini_requests_per_minute'), config.get('gemini_max_concurrency')
+
+def load_embedder_backend():
+    """Returns the configured embedder backend ('sentence_transformers', 'onnx' or 'hashing'); None where unset."""
+    return _load_config().get('embedder_backend')
+
+def vector_db_options():
+    """Returns the VectorDatabase keyword arguments for this install's own library."""
+    admin = is_admin()
+    # Students only read the index, so it is mapped rather than loaded; the admin mutates it.
+    # Only the admin runs full rebuilds with a pool of encoding processes. A student's fallback
+    # rebuild never adds the float32 rescore copy, whatever the synced index used.
+    # Without an embedder_backend the index's own is used; a different one (e.g. 'onnx' on a
+    # student install without PyTorch) means the library is re-embedded locally.
+    return {'memory_map': not admin, 'encode_processes': None if admin else 1, 'rescore': None if admin else False,
+            'embedder': load_embedder_backend()}
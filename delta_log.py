@@ -0,0 +1,110 @@
+import os
+import json
+import struct
+import zlib
+import logging
+from threading import Lock
+import numpy as np
+
+LOG_MAGIC = b'LWDL'
+HEADER = struct.Struct('<4sIQ') # magic, dimension, generation
+RECORD_HEADER = struct.Struct('<BIII') # op, count, payload size, crc32 of payload
+OP_ADD = 1
+OP_REMOVE = 2
+
+class DeltaLog:
+    """Append-only log of index mutations made since the snapshot of the same generation.
+
+    Each record carries its own checksum, so a torn append from a crash is detected and
+    dropped on replay instead of corrupting the index.
+    """
+
+    def __init__(self, path, dimension):
+        self.path = path
+        self.dimension = dimension
+        self._lock = Lock()
+
+    def _read_header(self, f):
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        magic, dimension, generation = HEADER.unpack(header)
+        if magic != LOG_MAGIC or dimension != self.dimension:
+            return None
+        return generation
+
+    def generation(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            return self._read_header(f)
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def has_records(self):
+        return self.size() > HEADER.size
+
+    def _append(self, op, ids, payload, generation):
+        ids = np.ascontiguousarray(ids, dtype='<i8')
+        payload = ids.tobytes() + payload
+        record = RECORD_HEADER.pack(op, len(ids), len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if not os.path.exists(self.path):
+                with open(self.path, 'wb') as f: f.write(HEADER.pack(LOG_MAGIC, self.dimension, generation))
+            with open(self.path, 'ab') as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def append_add(self, ids, vectors, rows, generation):
+        """Logs pages added with their vectors and metadata rows."""
+        vectors = np.ascontiguousarray(vectors, dtype='<f4')
+        self._append(OP_ADD, ids, vectors.tobytes() + json.dumps(rows).encode('utf-8'), generation)
+
+    def append_remove(self, ids, generation):
+        self._append(OP_REMOVE, ids, b'', generation)
+
+    def replay(self):
+        """Yields ('add', ids, vectors, rows) and ('remove', ids) records in order, truncating a torn tail."""
+        if not os.path.exists(self.path):
+            return
+        with self._lock, open(self.path, 'r+b') as f:
+            if self._read_header(f) is None:
+                logging.warning(f"Delta log '{self.path}' has an incompatible header. Ignoring it.")
+                return
+            valid_end = f.tell()
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if not header: break
+                if len(header) < RECORD_HEADER.size: break
+                op, count, size, crc = RECORD_HEADER.unpack(header)
+                payload = f.read(size)
+                if len(payload) < size or zlib.crc32(payload) != crc: break
+                ids = np.frombuffer(payload[:count * 8], dtype='<i8')
+                if op == OP_ADD:
+                    vector_bytes = count * self.dimension * 4
+                    vectors = np.frombuffer(payload[count * 8:count * 8 + vector_bytes], dtype='<f4').reshape(count, self.dimension)
+                    yield 'add', ids, vectors, json.loads(payload[count * 8 + vector_bytes:].decode('utf-8'))
+                elif op == OP_REMOVE:
+                    yield 'remove', ids
+                valid_end = f.tell()
+            if valid_end < os.path.getsize(self.path):
+                logging.warning(f"Delta log '{self.path}' ends in a partial record. Truncating it.")
+                f.truncate(valid_end)
+
+    def rebase(self, generation, offset=None):
+        """Starts the log for a new snapshot generation, keeping only records written after offset."""
+        with self._lock:
+            tail = b''
+            if offset is not None and os.path.exists(self.path):
+                with open(self.path, 'rb') as f:
+                    f.seek(max(offset, HEADER.size))
+                    tail = f.read()
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(HEADER.pack(LOG_MAGIC, self.dimension, generation))
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
@@ -54,8 +54,11 @@ class DriveService:
                     percent_complete = int(status.progress() * 100)
                     progress_callback(f"Downloading '{os.path.basename(local_path)}': {percent_complete}%")
 
-            with open(local_path, 'wb') as f:
+            # Replace the file in one step so readers never see a partially written copy.
+            tmp_path = local_path + '.download'
+            with open(tmp_path, 'wb') as f:
                 f.write(fh.getvalue())
+            os.replace(tmp_path, local_path)
             
             if progress_callback:
                 progress_callback(f"'{os.path.basename(local_path)}' complete.")
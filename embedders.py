@@ -0,0 +1,205 @@
+import os
+import re
+import atexit
+import hashlib
+import logging
+from threading import Lock
+import numpy as np
+
+# 'sentence_transformers' runs the model on PyTorch; 'onnx' runs an int8-quantized export of the
+# same model on ONNX Runtime, which needs neither torch nor a GPU; 'hashing' is a deterministic
+# bag-of-words embedder without any model, for offline tests and benchmarks.
+EMBEDDER_BACKENDS = ('sentence_transformers', 'onnx', 'hashing')
+DEFAULT_EMBEDDER_BACKEND = 'sentence_transformers'
+MODEL_NAME = 'all-MiniLM-L6-v2'
+# Known output sizes, so an empty index can be created without loading the model.
+MODEL_DIMENSIONS = {'all-MiniLM-L6-v2': 384}
+
+# Hugging Face repositories that ship ONNX exports, and the quantized file to use from them.
+ONNX_REPOSITORIES = {'all-MiniLM-L6-v2': 'sentence-transformers/all-MiniLM-L6-v2'}
+ONNX_MODEL_FILE = 'onnx/model_quint8_avx2.onnx'
+ONNX_MAX_SEQ_LENGTH = 256
+ONNX_BATCH_SIZE = 32
+
+HASHING_DIMENSION = 384
+
+class Embedder:
+    """Turns texts into float32 vectors of a fixed dimension."""
+
+    backend = None
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    @property
+    def cache_name(self):
+        # Identifies the vector space, for embedding caches shared between backends.
+        return f"{self.model_name}-{self.backend}"
+
+    @property
+    def dimension(self):
+        raise NotImplementedError
+
+    def encode(self, texts, show_progress_bar=False):
+        raise NotImplementedError
+
+    def encode_bulk(self, texts, processes):
+        """Encodes a large batch, using up to processes cores where the backend can."""
+        return self.encode(texts)
+
+class SentenceTransformerEmbedder(Embedder):
+    backend = 'sentence_transformers'
+    chunk_size = 32
+
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        self._model = None
+        self._pools = {}
+        self._lock = Lock()
+
+    @property
+    def cache_name(self):
+        # Kept as the bare model name so caches written before backends existed stay valid.
+        return self.model_name
+
+    @property
+    def model(self):
+        # Loaded lazily so paths that only load or remove IDs never pay for the model.
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                logging.info(f"Loading embedding model '{self.model_name}' (shared across all vector databases)...")
+                self._model = SentenceTransformer(self.model_name)
+                MODEL_DIMENSIONS.setdefault(self.model_name, self._model.get_sentence_embedding_dimension())
+            return self._model
+
+    @property
+    def dimension(self):
+        if self.model_name in MODEL_DIMENSIONS:
+            return MODEL_DIMENSIONS[self.model_name]
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, show_progress_bar=False):
+        return np.asarray(self.model.encode(texts, convert_to_tensor=False, show_progress_bar=show_progress_bar), dtype='float32')
+
+    def encode_bulk(self, texts, processes):
+        # The multi-process pool returns embeddings in input order, so results match encode.
+        if processes <= 1:
+            return self.encode(texts)
+        model = self.model
+        with self._lock:
+            pool = self._pools.get(processes)
+            if pool is None:
+                logging.info(f"Starting {processes} encoding processes for '{self.model_name}'...")
+                pool = self._pools[processes] = model.start_multi_process_pool(target_devices=['cpu'] * processes)
+        return np.asarray(model.encode_multi_process(texts, pool, chunk_size=self.chunk_size), dtype='float32')
+
+    def stop_pools(self):
+        with self._lock:
+            for pool in self._pools.values():
+                self._model.stop_multi_process_pool(pool)
+            self._pools.clear()
+
+class OnnxEmbedder(Embedder):
+    """Mean-pooled, normalised sentence embeddings from a quantized ONNX export, like sentence-transformers."""
+
+    backend = 'onnx'
+
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        self._session = None
+        self._tokenizer = None
+        self._lock = Lock()
+
+    def _model_files(self):
+        # A local directory holding model.onnx and tokenizer.json, or a known Hub model.
+        if os.path.isdir(self.model_name):
+            return os.path.join(self.model_name, 'model.onnx'), os.path.join(self.model_name, 'tokenizer.json')
+        from huggingface_hub import hf_hub_download
+        repository = ONNX_REPOSITORIES.get(self.model_name, self.model_name)
+        return hf_hub_download(repository, ONNX_MODEL_FILE), hf_hub_download(repository, 'tokenizer.json')
+
+    def _load(self):
+        with self._lock:
+            if self._session is None:
+                try:
+                    import onnxruntime
+                    from tokenizers import Tokenizer
+                except ImportError as e:
+                    raise ImportError("The 'onnx' embedder needs the onnxruntime, tokenizers and huggingface_hub packages.") from e
+                logging.info(f"Loading quantized ONNX embedding model '{self.model_name}'...")
+                model_path, tokenizer_path = self._model_files()
+                tokenizer = Tokenizer.from_file(tokenizer_path)
+                tokenizer.enable_truncation(max_length=ONNX_MAX_SEQ_LENGTH)
+                tokenizer.enable_padding()
+                self._session = onnxruntime.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+                self._tokenizer = tokenizer
+                MODEL_DIMENSIONS.setdefault(self.model_name, self._session.get_outputs()[0].shape[-1])
+        return self._session, self._tokenizer
+
+    @property
+    def dimension(self):
+        if self.model_name not in MODEL_DIMENSIONS:
+            self._load()
+        return MODEL_DIMENSIONS[self.model_name]
+
+    def encode(self, texts, show_progress_bar=False):
+        session, tokenizer = self._load()
+        input_names = {i.name for i in session.get_inputs()}
+        vectors = np.empty((len(texts), self.dimension), dtype='float32')
+        # Batching texts of similar length keeps padding, and so wasted compute, small.
+        order = np.argsort([len(t) for t in texts], kind='stable')
+        for start in range(0, len(texts), ONNX_BATCH_SIZE):
+            batch = order[start:start + ONNX_BATCH_SIZE]
+            encodings = tokenizer.encode_batch([texts[i] for i in batch])
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {'input_ids': np.array([e.ids for e in encodings], dtype=np.int64), 'attention_mask': mask,
+                     'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64)}
+            hidden = session.run(None, {name: value for name, value in feeds.items() if name in input_names})[0]
+            pooled = (hidden * mask[..., None]).sum(axis=1) / np.maximum(mask.sum(axis=1, keepdims=True), 1)
+            vectors[batch] = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+class HashingEmbedder(Embedder):
+    """Signed feature hashing of lower-cased words and word pairs, L2-normalised. Needs no model."""
+
+    backend = 'hashing'
+
+    def __init__(self, model_name, dimension=HASHING_DIMENSION):
+        super().__init__(model_name)
+        self._dimension = dimension
+
+    @property
+    def dimension(self):
+        return self._dimension
+
+    def encode(self, texts, show_progress_bar=False):
+        vectors = np.zeros((len(texts), self._dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            words = re.findall(r'\w+', (text or '').lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                vectors[row, (digest >> 1) % self._dimension] += 1.0 if digest & 1 else -1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm > 0: vectors[row] /= norm
+        return vectors
+
+_BACKEND_CLASSES = {'sentence_transformers': SentenceTransformerEmbedder, 'onnx': OnnxEmbedder, 'hashing': HashingEmbedder}
+_shared_embedders = {}
+_shared_embedders_lock = Lock()
+
+def get_embedder(backend=DEFAULT_EMBEDDER_BACKEND, model_name=MODEL_NAME):
+    """Returns the process-wide embedder for backend and model_name, creating it on first use."""
+    if backend not in EMBEDDER_BACKENDS:
+        raise ValueError(f"Unknown embedder backend '{backend}'. Expected one of {EMBEDDER_BACKENDS}.")
+    with _shared_embedders_lock:
+        embedder = _shared_embedders.get((backend, model_name))
+        if embedder is None:
+            embedder = _shared_embedders[(backend, model_name)] = _BACKEND_CLASSES[backend](model_name)
+    return embedder
+
+@atexit.register
+def stop_encode_pools():
+    with _shared_embedders_lock:
+        for embedder in _shared_embedders.values():
+            if isinstance(embedder, SentenceTransformerEmbedder): embedder.stop_pools()
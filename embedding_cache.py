@@ -0,0 +1,133 @@
+import os
+import re
+import hashlib
+import logging
+from collections import OrderedDict
+from threading import Lock
+import numpy as np
+
+CACHE_MAGIC = b'LWEC'
+HEADER_SIZE = 16
+# Embeddings computed recently by any repository in this process, so indexing the same
+# document into its year and into Admin only encodes it once.
+RECENT_CACHE_SIZE = 4096
+
+_recent = OrderedDict()
+_recent_lock = Lock()
+
+def text_hash(text):
+    return hashlib.blake2b((text or '').encode('utf-8'), digest_size=16).digest()
+
+class EmbeddingCache:
+    """Append-only binary file of (text hash, float32 vector) records for one embedding model."""
+
+    def __init__(self, cache_dir, model_name, dimension):
+        safe_model_name = re.sub(r'[^A-Za-z0-9_.-]', '_', model_name)
+        self.path = os.path.join(cache_dir, f"embedding_cache_{safe_model_name}.bin")
+        self.model_name = model_name
+        self.dimension = dimension
+        self.record_dtype = np.dtype([('key', 'V16'), ('vector', '<f4', (dimension,))])
+        self._vectors = None
+        self._lock = Lock()
+
+    def _header(self):
+        return CACHE_MAGIC + np.uint32(self.dimension).tobytes() + b'\x00' * (HEADER_SIZE - 8)
+
+    def _load(self):
+        self._vectors = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+                if header[:4] != CACHE_MAGIC or np.frombuffer(header[4:8], dtype=np.uint32)[0] != self.dimension:
+                    logging.warning(f"Embedding cache '{self.path}' has an incompatible header. Ignoring it.")
+                    os.remove(self.path)
+                    return
+                # A torn final append leaves a partial record; only whole records are read.
+                records = np.fromfile(f, dtype=self.record_dtype)
+            for record in records:
+                self._vectors[record['key'].tobytes()] = record['vector']
+            logging.info(f"Loaded {len(self._vectors)} cached embeddings from {self.path}")
+        except Exception as e:
+            logging.error(f"Failed to read embedding cache '{self.path}': {e}. Starting empty.")
+            self._vectors = {}
+
+    def _append(self, keys, vectors):
+        records = np.empty(len(keys), dtype=self.record_dtype)
+        records['key'] = keys
+        records['vector'] = vectors
+        try:
+            if os.path.exists(self.path):
+                # Drop any partial trailing record before appending.
+                body_size = os.path.getsize(self.path) - HEADER_SIZE
+                whole = body_size - (body_size % self.record_dtype.itemsize)
+                if whole != body_size:
+                    with open(self.path, 'r+b') as f: f.truncate(HEADER_SIZE + whole)
+                mode = 'ab'
+            else:
+                mode = 'wb'
+            with open(self.path, mode) as f:
+                if mode == 'wb': f.write(self._header())
+                f.write(records.tobytes())
+        except Exception as e:
+            logging.error(f"Failed to append to embedding cache '{self.path}': {e}")
+
+    def encode(self, texts, encode_fn):
+        """Returns float32 embeddings for texts, calling encode_fn only for texts not seen before."""
+        vectors = np.empty((len(texts), self.dimension), dtype='float32')
+        if not texts:
+            return vectors
+        keys = [text_hash(t) for t in texts]
+        misses = OrderedDict()
+        with self._lock:
+            if self._vectors is None: self._load()
+            for i, key in enumerate(keys):
+                vector = self._vectors.get(key)
+                if vector is None:
+                    with _recent_lock:
+                        vector = _recent.get((self.model_name, key))
+                if vector is None:
+                    misses.setdefault(key, []).append(i)
+                else:
+                    vectors[i] = vector
+
+        if misses:
+            miss_keys = list(misses.keys())
+            miss_texts = [texts[misses[key][0]] for key in miss_keys]
+            encoded = np.asarray(encode_fn(miss_texts), dtype='float32')
+            with self._lock:
+                for key, vector in zip(miss_keys, encoded):
+                    self._vectors[key] = vector
+                    for i in misses[key]: vectors[i] = vector
+                self._append(miss_keys, encoded)
+
+        with _recent_lock:
+            for key, vector in zip(keys, vectors):
+                _recent[(self.model_name, key)] = vector
+                _recent.move_to_end((self.model_name, key))
+            while len(_recent) > RECENT_CACHE_SIZE:
+                _recent.popitem(last=False)
+
+        logging.info(f"Embedding cache: {len(texts) - sum(len(v) for v in misses.values())} hits, {len(misses)} texts encoded.")
+        return vectors
+
+    def compact_keys(self, keep):
+        """Rewrites the cache so it only holds the entries whose text hash is in keep, dropping stale embeddings."""
+        with self._lock:
+            if self._vectors is None: self._load()
+            self._vectors = {key: vector for key, vector in self._vectors.items() if key in keep}
+            if not self._vectors:
+                if os.path.exists(self.path): os.remove(self.path)
+                return
+            records = np.empty(len(self._vectors), dtype=self.record_dtype)
+            records['key'] = list(self._vectors.keys())
+            records['vector'] = np.stack(list(self._vectors.values()))
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(self._header())
+                    f.write(records.tobytes())
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logging.error(f"Failed to compact embedding cache '{self.path}': {e}")
@@ -0,0 +1,129 @@
+import os
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from vector_db import VectorDatabase
+
+# Year indexes are opened memory-mapped on first use and kept while they add up to less than
+# FEDERATED_MEMORY_BUDGET bytes; beyond that the least recently searched go first. A mapped
+# index counts with the size of its files, one held in memory (e.g. after replaying a delta
+# log) with the memory it takes.
+FEDERATED_MEMORY_BUDGET = 1024 * 1024 * 1024
+FEDERATED_SEARCH_THREADS = 4
+
+class FederatedSearch:
+    """Searches the indexes of several year repositories together, as one ranked list."""
+
+    def __init__(self, year_paths, memory_budget=FEDERATED_MEMORY_BUDGET, max_workers=FEDERATED_SEARCH_THREADS):
+        self.year_paths = dict(year_paths)
+        self.memory_budget = memory_budget
+        self._open = OrderedDict() # year -> (VectorDatabase, file signature, size in bytes)
+        self._held = {} # year -> number of released() blocks rewriting its files
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='federated-search')
+
+    def available_years(self):
+        """Years whose index exists locally, e.g. after a Drive sync."""
+        return [year for year, path in self.year_paths.items() if os.path.exists(os.path.join(path, 'faiss_index.idx'))]
+
+    def _signature(self, database):
+        # Changes whenever a snapshot is published or the delta log grows.
+        paths = database.index_file_paths()
+        return tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else None for p in paths), database.delta_log.size()
+
+    def _size(self, database):
+        if not database.memory_mapped:
+            return database.memory_usage()
+        return sum(os.path.getsize(p) for p in database.index_file_paths() if os.path.exists(p))
+
+    def _database(self, year):
+        # Opening maps the files, so it is cheap; it runs under the lock to never open a year twice.
+        with self._lock:
+            entry = self._open.get(year)
+            if entry is None:
+                logging.info(f"Opening {year} index for federated search.")
+                # Files being rewritten are read into memory instead, so that they can be replaced.
+                database = VectorDatabase(self.year_paths[year], memory_map=year not in self._held)
+                size = self._size(database)
+            else:
+                database, signature, size = entry
+                if self._signature(database) != signature:
+                    # The files were updated since; load_index swaps the new state in under running searches.
+                    database.load_index()
+                    size = self._size(database)
+            self._open[year] = (database, self._signature(database), size)
+            self._open.move_to_end(year)
+            self._evict()
+            return database
+
+    def _evict(self):
+        # Searches still holding an evicted database finish on it; it is freed afterwards.
+        total = sum(size for _, _, size in self._open.values())
+        while total > self.memory_budget and len(self._open) > 1:
+            year, (_, _, size) = self._open.popitem(last=False)
+            total -= size
+            logging.info(f"Evicted {year} index from federated search ({size} bytes).")
+
+    def release(self, year):
+        """Closes the index of year, copying it into memory for searches still running on it."""
+        with self._lock:
+            entry = self._open.pop(year, None)
+        if entry is not None:
+            # Windows cannot replace a file while it is mapped.
+            entry[0].load_into_memory()
+            logging.info(f"Released {year} index from federated search.")
+
+    @contextmanager
+    def released(self, year):
+        """Keeps the files of year unmapped while a snapshot write or a Drive sync replaces them."""
+        with self._lock:
+            self._held[year] = self._held.get(year, 0) + 1
+        self.release(year)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._held[year] -= 1
+                if not self._held[year]: del self._held[year]
+            # An in-memory copy opened meanwhile is dropped; the next search maps the new files.
+            self.release(year)
+
+    def open_years(self):
+        with self._lock:
+            return list(self._open.keys())
+
+    def search(self, query, years=None, top_k=10, content_type_filter='all', hybrid=False):
+        """Returns the top_k pages for query across years (default: all available locally), best first.
+
+        Each result carries its 'year'. A page present in several years (same document name and
+        page number, e.g. Admin and the year it was uploaded to) is returned once, with its best score.
+        Hybrid results are ranked by their 'fused_score', so keyword matches keep their weight.
+        """
+        available = self.available_years()
+        years = [year for year in (years or available) if year in available]
+        if not years:
+            return []
+        databases = {year: self._database(year) for year in years}
+
+        # The query is encoded once per embedding space, not once per year.
+        query_vectors = {}
+        for database in databases.values():
+            key = database.embedder.cache_name
+            if key not in query_vectors: query_vectors[key] = database.encode_queries([query])
+
+        def search_year(year):
+            database = databases[year]
+            results = database.search_many([query], top_k, content_type_filter, hybrid=hybrid,
+                                           query_vectors=query_vectors[database.embedder.cache_name])[0]
+            return [{**result, 'year': year} for result in results]
+
+        rank_key = 'fused_score' if hybrid else 'score'
+        best = {}
+        for results in self._executor.map(search_year, years):
+            for result in results:
+                key = (result['document_name'], result['page_number'])
+                if key not in best or result[rank_key] > best[key][rank_key]:
+                    best[key] = result
+        return sorted(best.values(), key=lambda result: result[rank_key], reverse=True)[:top_k]
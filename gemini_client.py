@@ -1,24 +1,180 @@
 import os
+import asyncio
 import logging
-import google.generativeai as genai
 import json
+from analysis_cache import get_analysis_cache, cache_key, content_hash
+from gemini_governor import get_governor, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from gemini_handles import get_handle_registry
+from google.genai.types import Content, Part, FileData
 
 MODEL_NAME = "gemini-2.5-pro" 
+# Part of every analysis cache key; bump it when an indexing prompt changes so results
+# produced by the old prompt are no longer reused.
+ANALYSIS_PROMPT_VERSION = 1
+YOUTUBE_MODEL_NAME = "gemini-2.5-pro"
+
+# Short pages are analysed several to a request, so the instructions are sent once per batch.
+# A batch holds pages up to ANALYSIS_BATCH_TOKEN_BUDGET estimated input tokens (about
+# CHARS_PER_TOKEN characters each) and at most ANALYSIS_BATCH_MAX_PAGES pages, which bounds the
+# answer as well. A longer page is sent on its own.
+ANALYSIS_BATCH_TOKEN_BUDGET = 16000
+ANALYSIS_BATCH_MAX_PAGES = 8
+CHARS_PER_TOKEN = 4
+
+BATCH_ANALYSIS_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "page": {"type": "INTEGER"},
+            "title": {"type": "STRING"},
+            "questions": {"type": "ARRAY", "items": {"type": "STRING"}},
+            "topics": {"type": "ARRAY", "items": {"type": "STRING"}},
+            "enhanced_text": {"type": "STRING"},
+        },
+        "required": ["page", "title", "questions", "topics", "enhanced_text"],
+    },
+}
+
+def estimate_tokens(text):
+    return len(text or '') // CHARS_PER_TOKEN + 1
+
+def plan_analysis_batches(page_texts, token_budget=ANALYSIS_BATCH_TOKEN_BUDGET, max_pages=ANALYSIS_BATCH_MAX_PAGES):
+    """Groups page indices, in order, into batches of at most token_budget estimated tokens and max_pages pages."""
+    batches, batch, batch_tokens = [], [], 0
+    for i, text in enumerate(page_texts):
+        tokens = estimate_tokens(text)
+        if batch and (batch_tokens + tokens > token_budget or len(batch) == max_pages):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch: batches.append(batch)
+    return batches
+
+def _page_analysis_prompt(page_text, original_filename):
+    return f"""**Your Role:** You are an automated indexing agent. Your purpose is to analyze and structure content so it can be embedded and easily discovered in a semantic vector database.
+**Your Task:** Analyze the text from a document page below. Extract the requested metadata into the specified fields. The goal is to capture the essence of the content so a user can find it by asking natural questions.
+**Source Filename:** {original_filename}
+
+**###TITLE###**
+(Provide a concise, descriptive title for the content on this page. Max 10 words.)
+**###QUESTIONS###**
+(List 3-5 implicit questions this text answers. These should be the questions a user would ask to find this information.)
+**###TOPICS###**
+(Provide a comma-separated list of the main keywords, concepts, and named entities discussed.)
+**###ENHANCED_TEXT###**
+(This is the most critical part for vector search. **Start with the exact phrase "Source Filename: {original_filename}".** Then, provide a detailed, comprehensive description of the page's text content. The goal is to create a rich text that fully represents the page's content for embedding.)
+---
+**TEXT TO ANALYZE:**
+{page_text}"""
+
+def _batch_analysis_prompt(page_texts, original_filename):
+    pages = "\n\n".join(f"===PAGE {number}===\n{text}" for number, text in enumerate(page_texts, 1))
+    return f"""**Your Role:** You are an automated indexing agent. Your purpose is to analyze and structure content so it can be embedded and easily discovered in a semantic vector database.
+**Your Task:** Analyze each of the {len(page_texts)} document pages below on its own. Return a JSON array with one object per page, in page order, with these fields. The goal is to capture the essence of each page so a user can find it by asking natural questions.
+**Source Filename:** {original_filename}
+
+- "page": The number of the page, from its ===PAGE n=== marker.
+- "title": A concise, descriptive title for the content on this page. Max 10 words.
+- "questions": 3-5 implicit questions this text answers. These should be the questions a user would ask to find this information.
+- "topics": The main keywords, concepts, and named entities discussed.
+- "enhanced_text": This is the most critical part for vector search. **Start with the exact phrase "Source Filename: {original_filename}".** Then, provide a detailed, comprehensive description of the page's text content. The goal is to create a rich text that fully represents the page's content for embedding.
+---
+**PAGES TO ANALYZE:**
+{pages}"""
+
+def _format_page_analysis(item):
+    """Renders one page of a batched JSON answer in the ###SECTION### format of single-page analyses."""
+    questions = "\n".join(f"- {question}" for question in item['questions'])
+    return f"###TITLE###\n{item['title']}\n###QUESTIONS###\n{questions}\n###TOPICS###\n{', '.join(item['topics'])}\n###ENHANCED_TEXT###\n{item['enhanced_text']}"
+
+def _parse_batch_analysis(response_text, num_pages):
+    """Returns {page index: analysis} for the well-formed pages of a batched answer; the rest are missing."""
+    try:
+        items = json.loads(response_text)
+    except (TypeError, ValueError) as e:
+        logging.warning(f"Batched analysis was not valid JSON: {e}")
+        return {}
+    analyses = {}
+    for item in items if isinstance(items, list) else []:
+        try:
+            index = int(item['page']) - 1
+            if not 0 <= index < num_pages or index in analyses: continue
+            if not (isinstance(item['title'], str) and isinstance(item['enhanced_text'], str) and item['enhanced_text'].strip()): continue
+            if not all(isinstance(item[field], list) and all(isinstance(value, str) for value in item[field]) for field in ('questions', 'topics')): continue
+            analyses[index] = _format_page_analysis(item)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return analyses
+
+def _page_analysis_error(original_filename, e):
+    return f"###TITLE###\nAnalysis Error\n###QUESTIONS###\nNone\n###TOPICS###\nError\n###ENHANCED_TEXT###\nSource Filename: {original_filename}. API Error: {e}"
+
+def _pdf_page_analysis_prompt(page_number, original_filename):
+    return f"""**Your Role:** You are an automated indexing agent with Optical Character Recognition (OCR) capabilities. Your purpose is to analyze and structure content from a PDF page image so it can be embedded and easily discovered in a semantic vector database.
+**Your Task:** Analyze the single-page PDF provided. This page may be a scanned document, a diagram, or a text-light page. Perform OCR to extract any text and analyze the visual layout. Extract the requested metadata into the specified fields below.
+**Source Filename:** {original_filename}
+**Page Number:** {page_number}
+**###TITLE###**
+(Provide a concise, descriptive title for the content on this page. Max 10 words.)
+**###QUESTIONS###**
+(List 3-5 implicit questions this content answers. These should be the questions a user would ask to find this information.)
+**###TOPICS###**
+(Provide a comma-separated list of the main keywords, concepts, and named entities from the OCR text and any diagrams.)
+**###ENHANCED_TEXT###**
+(This is the most critical part. **Start with "Source Filename: {original_filename}".** Then, provide a detailed, comprehensive description of the page. This must include a full transcription of all text found via OCR, combined with descriptions of any images, diagrams, or important structural elements on the page.)
+"""
+
+def _pdf_page_analysis_error(page_number, original_filename, e):
+    logging.error(f"Gemini visual analysis error for page {page_number} of {original_filename}: {e}")
+    return f"###TITLE###\nVisual Analysis Error\n###QUESTIONS###\nNone\n###TOPICS###\nError\n###ENHANCED_TEXT###\nSource Filename: {original_filename}. Visual API Error: {e}"
+
+def _pdf_page_key(pdf_path, original_filename):
+    with open(pdf_path, 'rb') as f:
+        return cache_key('pdf_page', MODEL_NAME, ANALYSIS_PROMPT_VERSION, original_filename, content_hash(f.read()))
+
+YOUTUBE_ANALYSIS_PROMPT = """You are a video indexing agent. Your task is to watch the provided YouTube video and create a detailed, time-stamped summary.
+    Follow these instructions precisely:
+    1. Divide the video into logical segments, each approximately 60-90 seconds long.
+    2. For each segment, create a block of text.
+    3. Each block MUST start with the line `###SEGMENT###` followed on the next line by `Timestamp: [start_time_in_seconds]`.
+    4. After the timestamp, provide a detailed summary of that segment. Include key spoken points, visual elements, and any text shown on screen.
+    """
+
+def _youtube_contents(youtube_url):
+    return Content(
+        parts=[
+            Part(file_data=FileData(file_uri=youtube_url)),
+            Part(text=YOUTUBE_ANALYSIS_PROMPT)
+        ]
+    )
 
 class GeminiClient:
-    def _configure_genai(self, api_key):
-        if not api_key:
-            raise ValueError("API key is required for Gemini client.")
+    """Gemini API calls of the app. The ingest analyses also have *_async variants, for the
+    asyncio ingestion pipeline, which share prompts, cache and governor with the blocking ones."""
+
+    def __init__(self, analysis_cache=None):
+        self.analysis_cache = analysis_cache or get_analysis_cache()
+
+    def _model(self, api_key, generation_config=None):
+        # Handles are pooled per key, model and config; see gemini_handles.
         try:
-            genai.configure(api_key=api_key)
+            return get_handle_registry().model(api_key, MODEL_NAME, generation_config)
         except Exception as e:
             logging.error(f"Failed to configure Gemini client: {e}")
             raise
 
+    def _generate(self, model, contents, priority):
+        # Every request goes through the shared governor, which rate-limits, queues by priority and retries.
+        return get_governor().call(lambda: model.generate_content(contents), priority)
+
+    async def _generate_async(self, model, contents, priority):
+        return await get_governor().call_async(lambda: model.generate_content_async(contents), priority)
+
     def refine_query_for_search(self, query, history, api_key):
         try:
-            self._configure_genai(api_key)
-            model = genai.GenerativeModel(MODEL_NAME)
+            model = self._model(api_key)
             history_str = "\n".join([f"User: {h.user_message}\nAI: {h.ai_response}" for h in history])
             prompt = f"""Based on the following conversation history and the latest user query, generate a single, comprehensive search query that captures the user's full intent. The query should be optimized for a semantic vector database search. It should be a statement or a detailed question, combining keywords and concepts from the entire conversation.
 
@@ -29,40 +185,72 @@ class GeminiClient:
 
 **Optimized Search Query:**
 """
-            response = model.generate_content(prompt)
+            response = self._generate(model, prompt, PRIORITY_INTERACTIVE)
             return response.text.strip()
         except Exception as e:
             logging.error(f"Gemini query refinement error: {e}")
             return query
 
     def analyze_page_for_indexing(self, page_text, original_filename, api_key):
+        # The filename is part of the key because the analysis quotes it.
+        key = cache_key('page', MODEL_NAME, ANALYSIS_PROMPT_VERSION, original_filename, content_hash(page_text))
+        cached = self.analysis_cache.get(key)
+        if cached is not None:
+            return cached
         try:
-            self._configure_genai(api_key)
-            model = genai.GenerativeModel(MODEL_NAME)
-            prompt = f"""**Your Role:** You are an automated indexing agent. Your purpose is to analyze and structure content so it can be embedded and easily discovered in a semantic vector database.
-**Your Task:** Analyze the text from a document page below. Extract the requested metadata into the specified fields. The goal is to capture the essence of the content so a user can find it by asking natural questions.
-**Source Filename:** {original_filename}
+            model = self._model(api_key)
+            response = self._generate(model, _page_analysis_prompt(page_text, original_filename), PRIORITY_BACKGROUND)
+            result = response.text
+            if result: self.analysis_cache.put(key, result)
+            return result
+        except Exception as e:
+            return _page_analysis_error(original_filename, e)
 
-**###TITLE###**
-(Provide a concise, descriptive title for the content on this page. Max 10 words.)
-**###QUESTIONS###**
-(List 3-5 implicit questions this text answers. These should be the questions a user would ask to find this information.)
-**###TOPICS###**
-(Provide a comma-separated list of the main keywords, concepts, and named entities discussed.)
-**###ENHANCED_TEXT###**
-(This is the most critical part for vector search. **Start with the exact phrase "Source Filename: {original_filename}".** Then, provide a detailed, comprehensive description of the page's text content. The goal is to create a rich text that fully represents the page's content for embedding.)
----
-**TEXT TO ANALYZE:**
-{page_text}"""
-            response = model.generate_content(prompt)
-            return response.text
+    async def analyze_page_for_indexing_async(self, page_text, original_filename, api_key):
+        key = cache_key('page', MODEL_NAME, ANALYSIS_PROMPT_VERSION, original_filename, content_hash(page_text))
+        cached = await asyncio.to_thread(self.analysis_cache.get, key)
+        if cached is not None:
+            return cached
+        try:
+            model = self._model(api_key)
+            response = await self._generate_async(model, _page_analysis_prompt(page_text, original_filename), PRIORITY_BACKGROUND)
+            result = response.text
+            if result: await asyncio.to_thread(self.analysis_cache.put, key, result)
+            return result
         except Exception as e:
-            return f"###TITLE###\nAnalysis Error\n###QUESTIONS###\nNone\n###TOPICS###\nError\n###ENHANCED_TEXT###\nSource Filename: {original_filename}. API Error: {e}"
+            return _page_analysis_error(original_filename, e)
+
+    async def analyze_pages_for_indexing_async(self, page_texts, original_filename, api_key):
+        """Analyses several pages in one request (see plan_analysis_batches), returning an analysis per page.
+
+        Results share the single-page cache entries. A page missing from the answer or
+        malformed in it, or every page if the request fails, is analysed on its own instead.
+        """
+        keys = [cache_key('page', MODEL_NAME, ANALYSIS_PROMPT_VERSION, original_filename, content_hash(text)) for text in page_texts]
+        analyses = await asyncio.to_thread(lambda: [self.analysis_cache.get(key) for key in keys])
+        pending = [i for i, analysis in enumerate(analyses) if analysis is None]
+        if len(pending) > 1:
+            try:
+                model = self._model(api_key, {"response_mime_type": "application/json", "response_schema": BATCH_ANALYSIS_SCHEMA})
+                response = await self._generate_async(model, _batch_analysis_prompt([page_texts[i] for i in pending], original_filename), PRIORITY_BACKGROUND)
+                parsed = _parse_batch_analysis(response.text, len(pending))
+            except Exception as e:
+                logging.error(f"Batched analysis of {len(pending)} pages of {original_filename} failed: {e}")
+                parsed = {}
+            if len(parsed) < len(pending):
+                logging.warning(f"Batched analysis returned {len(parsed)} of {len(pending)} pages of {original_filename}; analysing the rest one by one.")
+            for position, analysis in parsed.items():
+                analyses[pending[position]] = analysis
+            await asyncio.to_thread(lambda: [self.analysis_cache.put(keys[pending[position]], analysis) for position, analysis in parsed.items()])
+        missing = [i for i, analysis in enumerate(analyses) if analysis is None]
+        singles = await asyncio.gather(*(self.analyze_page_for_indexing_async(page_texts[i], original_filename, api_key) for i in missing))
+        for i, analysis in zip(missing, singles):
+            analyses[i] = analysis
+        return analyses
 
     def generate_study_set(self, document_text, doc_filename, set_type, difficulty, question_count, api_key):
         try:
-            self._configure_genai(api_key)
-            model = genai.GenerativeModel(MODEL_NAME, generation_config={"response_mime_type": "application/json"})
+            model = self._model(api_key, {"response_mime_type": "application/json"})
             
             type_instruction = ""
             if set_type == 'quiz':
@@ -109,7 +297,7 @@ DOCUMENT TEXT TO ANALYZE:
 {document_text[:20000]} 
 """
             
-            response = model.generate_content(prompt)
+            response = self._generate(model, prompt, PRIORITY_INTERACTIVE)
             return json.loads(response.text)
 
         except Exception as e:
@@ -124,8 +312,7 @@ DOCUMENT TEXT TO ANALYZE:
 
     def get_answer_explanation(self, question, correct_answer, document_text, api_key):
         try:
-            self._configure_genai(api_key)
-            model = genai.GenerativeModel(MODEL_NAME)
+            model = self._model(api_key)
             prompt = f"""
 Based *only* on the provided document text, give a concise, one-sentence explanation for why the answer to the following question is correct.
 
@@ -139,7 +326,7 @@ Correct Answer: "{correct_answer}"
 
 Explanation: 
 """
-            response = model.generate_content(prompt)
+            response = self._generate(model, prompt, PRIORITY_INTERACTIVE)
             return response.text.strip()
         except Exception as e:
             logging.error(f"Error getting explanation: {e}", exc_info=True)
@@ -148,8 +335,7 @@ Explanation:
     def generate_learning_path_structure(self, full_transcript, doc_filename, api_key):
         """Generates the step-by-step structure for a learning path from any document type."""
         try:
-            self._configure_genai(api_key)
-            model = genai.GenerativeModel(MODEL_NAME, generation_config={"response_mime_type": "application/json"})
+            model = self._model(api_key, {"response_mime_type": "application/json"})
             prompt = f"""Your Role: You are an expert instructional designer.
 Your Task: Analyze the following document content and break it down into a logical, sequential learning path with 5 to 7 distinct steps. For each step, provide a short, descriptive `title` and a one-paragraph `description` of the core concept being taught in that segment. The final output must be a valid JSON object.
 
@@ -168,7 +354,7 @@ JSON Output Requirements:
 DOCUMENT CONTENT TO ANALYZE:
 {full_transcript[:25000]}
 """
-            response = model.generate_content(prompt)
+            response = self._generate(model, prompt, PRIORITY_BACKGROUND)
             return json.loads(response.text)
         except Exception as e:
             logging.error(f"Error generating learning path structure: {e}", exc_info=True)
@@ -177,8 +363,7 @@ DOCUMENT CONTENT TO ANALYZE:
     def generate_interactive_module(self, step_topic_description, api_key):
         """Generates a self-contained, interactive HTML file for a single learning step."""
         try:
-            self._configure_genai(api_key)
-            model = genai.GenerativeModel(MODEL_NAME)
+            model = self._model(api_key)
             # --- START OF NEW "GOD-LEVEL" PROMPT ---
             prompt = f"""**YOUR ROLE & PERSONA:**
 You are a world-class motion graphics artist and creative technologist, with a background at a top-tier studio like Pixar or Studio Ghibli. You are tasked with creating an educational masterpiece. Your work is not just code; it's an experience. It must be beautiful, intuitive, and unforgettable. Your output must be a single, complete HTML file and nothing else.
@@ -248,7 +433,7 @@ You are a world-class motion graphics artist and creative technologist, with a b
 </html>
 """
             # --- END OF NEW "GOD-LEVEL" PROMPT ---
-            response = model.generate_content(prompt)
+            response = self._generate(model, prompt, PRIORITY_BACKGROUND)
             cleaned_html = response.text.strip()
             if cleaned_html.startswith("```html"):
                 cleaned_html = cleaned_html[7:]
@@ -261,68 +446,85 @@ You are a world-class motion graphics artist and creative technologist, with a b
             return f"<html><body><h1>Error</h1><p>Failed to generate interactive content: {e}</p></body></html>"
 
     def analyze_pdf_page_for_indexing(self, pdf_path, page_number, original_filename, api_key):
-        logging.info(f"Performing visual analysis on page {page_number} of {original_filename}...")
         uploaded_file = None
         try:
-            self._configure_genai(api_key)
-            model = genai.GenerativeModel(MODEL_NAME)
-            uploaded_file = genai.upload_file(path=pdf_path, display_name=os.path.basename(pdf_path))
-            prompt = f"""**Your Role:** You are an automated indexing agent with Optical Character Recognition (OCR) capabilities. Your purpose is to analyze and structure content from a PDF page image so it can be embedded and easily discovered in a semantic vector database.
-**Your Task:** Analyze the single-page PDF provided. This page may be a scanned document, a diagram, or a text-light page. Perform OCR to extract any text and analyze the visual layout. Extract the requested metadata into the specified fields below.
-**Source Filename:** {original_filename}
-**Page Number:** {page_number}
-**###TITLE###**
-(Provide a concise, descriptive title for the content on this page. Max 10 words.)
-**###QUESTIONS###**
-(List 3-5 implicit questions this content answers. These should be the questions a user would ask to find this information.)
-**###TOPICS###**
-(Provide a comma-separated list of the main keywords, concepts, and named entities from the OCR text and any diagrams.)
-**###ENHANCED_TEXT###**
-(This is the most critical part. **Start with "Source Filename: {original_filename}".** Then, provide a detailed, comprehensive description of the page. This must include a full transcription of all text found via OCR, combined with descriptions of any images, diagrams, or important structural elements on the page.)
-"""
-            response = model.generate_content([prompt, uploaded_file])
-            return response.text
+            key = _pdf_page_key(pdf_path, original_filename)
+            cached = self.analysis_cache.get(key)
+            if cached is not None:
+                return cached
+            logging.info(f"Performing visual analysis on page {page_number} of {original_filename}...")
+            model = self._model(api_key)
+            uploaded_file = get_governor().call(lambda: model.client.files.upload(file=pdf_path, config={'display_name': os.path.basename(pdf_path)}), PRIORITY_BACKGROUND)
+            response = self._generate(model, [_pdf_page_analysis_prompt(page_number, original_filename), uploaded_file], PRIORITY_BACKGROUND)
+            result = response.text
+            if result: self.analysis_cache.put(key, result)
+            return result
+        except Exception as e:
+            return _pdf_page_analysis_error(page_number, original_filename, e)
+        finally:
+            if uploaded_file: self._delete_uploaded_file(model.client, uploaded_file)
+
+    async def analyze_pdf_page_for_indexing_async(self, pdf_path, page_number, original_filename, api_key):
+        uploaded_file = None
+        try:
+            key = await asyncio.to_thread(_pdf_page_key, pdf_path, original_filename)
+            cached = await asyncio.to_thread(self.analysis_cache.get, key)
+            if cached is not None:
+                return cached
+            logging.info(f"Performing visual analysis on page {page_number} of {original_filename}...")
+            model = self._model(api_key)
+            uploaded_file = await get_governor().call_async(lambda: model.client.aio.files.upload(file=pdf_path, config={'display_name': os.path.basename(pdf_path)}), PRIORITY_BACKGROUND)
+            response = await self._generate_async(model, [_pdf_page_analysis_prompt(page_number, original_filename), uploaded_file], PRIORITY_BACKGROUND)
+            result = response.text
+            if result: await asyncio.to_thread(self.analysis_cache.put, key, result)
+            return result
         except Exception as e:
-            logging.error(f"Gemini visual analysis error for page {page_number} of {original_filename}: {e}")
-            return f"###TITLE###\nVisual Analysis Error\n###QUESTIONS###\nNone\n###TOPICS###\nError\n###ENHANCED_TEXT###\nSource Filename: {original_filename}. Visual API Error: {e}"
+            return _pdf_page_analysis_error(page_number, original_filename, e)
         finally:
-            if uploaded_file:
-                try:
-                    genai.delete_file(uploaded_file.name)
-                    logging.info(f"Cleaned up temporary file '{uploaded_file.display_name}' from Gemini API.")
-                except Exception as e:
-                    logging.error(f"Failed to delete temporary file '{uploaded_file.name}' from Gemini API: {e}")
+            if uploaded_file: await asyncio.to_thread(self._delete_uploaded_file, model.client, uploaded_file)
+
+    def _delete_uploaded_file(self, client, uploaded_file):
+        try:
+            client.files.delete(name=uploaded_file.name)
+            logging.info(f"Cleaned up temporary file '{uploaded_file.display_name}' from Gemini API.")
+        except Exception as e:
+            logging.error(f"Failed to delete temporary file '{uploaded_file.name}' from Gemini API: {e}")
 
     def analyze_youtube_video_for_indexing(self, youtube_url, api_key):
-        from google import genai
-        from google.genai.types import Content, Part, FileData
+        key = cache_key('youtube', YOUTUBE_MODEL_NAME, ANALYSIS_PROMPT_VERSION, youtube_url)
+        cached = self.analysis_cache.get(key)
+        if cached is not None:
+            return cached
         try:
-            client = genai.Client(api_key=api_key)
-            prompt = """You are a video indexing agent. Your task is to watch the provided YouTube video and create a detailed, time-stamped summary.
-    Follow these instructions precisely:
-    1. Divide the video into logical segments, each approximately 60-90 seconds long.
-    2. For each segment, create a block of text.
-    3. Each block MUST start with the line `###SEGMENT###` followed on the next line by `Timestamp: [start_time_in_seconds]`.
-    4. After the timestamp, provide a detailed summary of that segment. Include key spoken points, visual elements, and any text shown on screen.
-    """
-            response = client.models.generate_content(
-                model="gemini-2.5-pro",
-                contents=Content(
-                    parts=[
-                        Part(file_data=FileData(file_uri=youtube_url)),
-                        Part(text=prompt)
-                    ]
-                )
-            )
-            return response.text
+            client = get_handle_registry().client(api_key)
+            contents = _youtube_contents(youtube_url)
+            response = get_governor().call(lambda: client.models.generate_content(model=YOUTUBE_MODEL_NAME, contents=contents), PRIORITY_BACKGROUND)
+            result = response.text
+            if result: self.analysis_cache.put(key, result)
+            return result
+        except Exception as e:
+            logging.error("Gemini video analysis error for %s: %s", youtube_url, e, exc_info=True)
+            return f"Error analyzing video: {e}"
+
+    async def analyze_youtube_video_for_indexing_async(self, youtube_url, api_key):
+        key = cache_key('youtube', YOUTUBE_MODEL_NAME, ANALYSIS_PROMPT_VERSION, youtube_url)
+        cached = await asyncio.to_thread(self.analysis_cache.get, key)
+        if cached is not None:
+            return cached
+        try:
+            client = get_handle_registry().client(api_key)
+            contents = _youtube_contents(youtube_url)
+            response = await get_governor().call_async(lambda: client.aio.models.generate_content(model=YOUTUBE_MODEL_NAME, contents=contents), PRIORITY_BACKGROUND)
+            result = response.text
+            if result: await asyncio.to_thread(self.analysis_cache.put, key, result)
+            return result
         except Exception as e:
             logging.error("Gemini video analysis error for %s: %s", youtube_url, e, exc_info=True)
             return f"Error analyzing video: {e}"
 
     def generate_response(self, user_message, context_pages, api_key):
         try:
-            self._configure_genai(api_key)
-            model = genai.GenerativeModel(MODEL_NAME)
+            model = self._model(api_key)
             formatted_context = ""
             if context_pages:
                 for page_info in context_pages:
@@ -368,16 +570,15 @@ You are Nexus, an intelligent and helpful AI assistant designed to answer user q
 Now, use the above logic to generate the best possible answer.
 """
 
-            response = model.generate_content(system_prompt)
+            response = self._generate(model, system_prompt, PRIORITY_INTERACTIVE)
             return response.text or "I apologize, but I couldn't generate a response."
         except Exception as e:
             logging.error(f"Gemini API chat error: {e}", exc_info=True)
             return f"I encountered an error while processing your request with the AI model: {e}"
     def validate_api_key(self, api_key):
         try:
-            self._configure_genai(api_key)
-            model = genai.GenerativeModel(MODEL_NAME)
-            model.generate_content("hello")
+            model = self._model(api_key)
+            self._generate(model, "hello", PRIORITY_INTERACTIVE)
             return True
         except Exception:
             return False
\ No newline at end of file
@@ -0,0 +1,201 @@
+import re
+import time
+import asyncio
+import heapq
+import random
+import logging
+import itertools
+from threading import Condition, Lock
+import config_manager
+
+# Every Gemini request of the process goes through one governor: at most
+# GEMINI_REQUESTS_PER_MINUTE start per minute (a token bucket allowing short bursts of up to
+# GEMINI_MAX_CONCURRENCY), at most GEMINI_MAX_CONCURRENCY run at once, and waiting requests
+# start in priority order. Both limits can be set in user_config.json.
+GEMINI_REQUESTS_PER_MINUTE = 150
+GEMINI_MAX_CONCURRENCY = 8
+
+# Someone is waiting on interactive requests (chat, study sets); ingest and learning-path
+# generation run in the background and yield to them.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+# Rate-limit and server errors are retried with exponential backoff and full jitter. A
+# rate-limit error also pauses every other request for the backoff delay.
+GEMINI_MAX_RETRIES = 5
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+def _status_code(error):
+    # google.api_core and google.genai errors carry the HTTP status as .code.
+    code = getattr(error, 'code', None)
+    if code is None: code = getattr(error, 'status_code', None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        match = re.match(r'\s*(\d{3})\b', str(error))
+        return int(match.group(1)) if match else None
+
+def is_rate_limited(error):
+    return _status_code(error) == 429 or 'RESOURCE_EXHAUSTED' in str(error)
+
+def is_retryable(error):
+    return _status_code(error) in RETRYABLE_STATUS_CODES or is_rate_limited(error)
+
+class GeminiGovernor:
+    """Schedules API calls under a shared request rate and concurrency limit, retrying transient failures.
+
+    Threads (call) and coroutines (call_async) wait in the same priority queue. A waiting
+    coroutine holds no thread; it is woken through its event loop.
+    """
+
+    def __init__(self, requests_per_minute=GEMINI_REQUESTS_PER_MINUTE, max_concurrency=GEMINI_MAX_CONCURRENCY):
+        self.rate = requests_per_minute / 60.0
+        self.max_concurrency = max_concurrency
+        self.capacity = max(1, min(max_concurrency, requests_per_minute))
+        self._tokens = float(self.capacity)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._active = 0
+        self._waiting = [] # heap of (priority, sequence) tickets
+        self._sequence = itertools.count()
+        self._condition = Condition(Lock())
+        self._async_waiters = {} # ticket -> (event loop, asyncio.Event)
+        self.counts = {'calls': 0, 'retries': 0, 'rate_limited': 0, 'failures': 0}
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _notify(self):
+        # Called with the lock held, whenever a waiting ticket may be able to start.
+        self._condition.notify_all()
+        for loop, event in self._async_waiters.values():
+            loop.call_soon_threadsafe(event.set)
+
+    def _try_start(self, ticket):
+        """Starts ticket if it is next and the limits allow. Otherwise returns how long to wait at most (None: until notified)."""
+        now = time.monotonic()
+        self._refill(now)
+        if self._waiting[0] == ticket and self._active < self.max_concurrency and now >= self._paused_until and self._tokens >= 1:
+            heapq.heappop(self._waiting)
+            self._tokens -= 1
+            self._active += 1
+            self.counts['calls'] += 1
+            # The next ticket may be able to start as well.
+            self._notify()
+            return 0.0
+        # Wake up when the pause ends or the next token is due, if nothing else changes first.
+        return max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.0) or None
+
+    def _abandon(self, ticket):
+        self._async_waiters.pop(ticket, None)
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+            self._notify()
+
+    def _acquire(self, priority):
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    delay = self._try_start(ticket)
+                    if delay == 0.0: return
+                    self._condition.wait(timeout=delay)
+            except BaseException:
+                self._abandon(ticket)
+                raise
+
+    async def _acquire_async(self, priority):
+        ticket = (priority, next(self._sequence))
+        event = asyncio.Event()
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            self._async_waiters[ticket] = (asyncio.get_running_loop(), event)
+        try:
+            while True:
+                with self._condition:
+                    delay = self._try_start(ticket)
+                    if delay == 0.0:
+                        del self._async_waiters[ticket]
+                        return
+                    event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._condition: self._abandon(ticket)
+            raise
+
+    def _release(self):
+        with self._condition:
+            self._active -= 1
+            self._notify()
+
+    def _pause(self, delay):
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def _count(self, name):
+        with self._condition:
+            self.counts[name] += 1
+
+    def _backoff(self, error, attempt):
+        """Returns the delay before retrying after error, or None if it must not be retried."""
+        if attempt == GEMINI_MAX_RETRIES or not is_retryable(error):
+            self._count('failures')
+            return None
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        if is_rate_limited(error):
+            self._count('rate_limited')
+            self._pause(delay)
+        self._count('retries')
+        logging.warning(f"Gemini request failed ({error}). Retrying in {delay:.1f}s (attempt {attempt + 1}/{GEMINI_MAX_RETRIES}).")
+        return delay
+
+    def call(self, fn, priority=PRIORITY_BACKGROUND):
+        """Runs fn() when the limits allow, retrying rate-limit and server errors. Raises the last error."""
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            self._acquire(priority)
+            try:
+                return fn()
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None: raise
+            finally:
+                self._release()
+            time.sleep(delay)
+
+    async def call_async(self, fn, priority=PRIORITY_BACKGROUND):
+        """Like call, for a coroutine function: awaits fn() when the limits allow, without blocking the event loop."""
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            await self._acquire_async(priority)
+            try:
+                return await fn()
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None: raise
+            finally:
+                self._release()
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        with self._condition:
+            return {**self.counts, 'active': self._active, 'waiting': len(self._waiting),
+                    'requests_per_minute': self.rate * 60, 'max_concurrency': self.max_concurrency}
+
+_shared_governor = None
+_shared_governor_lock = Lock()
+
+def get_governor():
+    """Returns the process-wide governor, with the limits from user_config.json or the defaults."""
+    global _shared_governor
+    with _shared_governor_lock:
+        if _shared_governor is None:
+            requests_per_minute, max_concurrency = config_manager.load_gemini_limits()
+            _shared_governor = GeminiGovernor(requests_per_minute or GEMINI_REQUESTS_PER_MINUTE, max_concurrency or GEMINI_MAX_CONCURRENCY)
+        return _shared_governor
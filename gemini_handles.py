@@ -0,0 +1,85 @@
+import json
+import time
+import logging
+from threading import Lock
+from google import genai
+from google.genai import types
+
+# One genai.Client per API key and one handle per (API key, model, generation config) are
+# created on first use and shared by every thread and coroutine afterwards. A client carries
+# its own key, so callers with different keys never touch shared configuration.
+
+class ModelHandle:
+    """A model bound to one client and generation config; generate_content(_async) may be called concurrently."""
+
+    def __init__(self, client, model_name, config):
+        self.client = client
+        self.model_name = model_name
+        self.config = config
+
+    def generate_content(self, contents):
+        return self.client.models.generate_content(model=self.model_name, contents=contents, config=self.config)
+
+    async def generate_content_async(self, contents):
+        return await self.client.aio.models.generate_content(model=self.model_name, contents=contents, config=self.config)
+
+class HandleRegistry:
+    """Thread-safe pool of Gemini clients and model handles, with the time spent creating them."""
+
+    def __init__(self):
+        self._clients = {}
+        self._handles = {}
+        self._lock = Lock()
+        self.counts = {'clients': 0, 'handles': 0, 'reused': 0}
+        self.setup_seconds = 0.0
+
+    def _client(self, api_key):
+        # Called with the lock held.
+        client = self._clients.get(api_key)
+        if client is None:
+            start = time.perf_counter()
+            client = self._clients[api_key] = genai.Client(api_key=api_key)
+            self.setup_seconds += time.perf_counter() - start
+            self.counts['clients'] += 1
+        return client
+
+    def client(self, api_key):
+        """Returns the shared genai.Client of api_key."""
+        if not api_key:
+            raise ValueError("API key is required for Gemini client.")
+        with self._lock:
+            return self._client(api_key)
+
+    def model(self, api_key, model_name, generation_config=None):
+        """Returns the shared handle of model_name with generation_config (a dict of GenerateContentConfig fields)."""
+        if not api_key:
+            raise ValueError("API key is required for Gemini client.")
+        key = (api_key, model_name, json.dumps(generation_config, sort_keys=True) if generation_config else None)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                self.counts['reused'] += 1
+                return handle
+            client = self._client(api_key)
+            start = time.perf_counter()
+            config = types.GenerateContentConfig(**generation_config) if generation_config else None
+            handle = self._handles[key] = ModelHandle(client, model_name, config)
+            self.setup_seconds += time.perf_counter() - start
+            self.counts['handles'] += 1
+            logging.info(f"Created Gemini handle for {model_name} ({len(self._handles)} pooled).")
+            return handle
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, 'setup_seconds': round(self.setup_seconds, 4)}
+
+_shared_registry = None
+_shared_registry_lock = Lock()
+
+def get_handle_registry():
+    """Returns the process-wide registry of Gemini clients and model handles."""
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = HandleRegistry()
+        return _shared_registry
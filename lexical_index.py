@@ -0,0 +1,98 @@
+import re
+import sqlite3
+import logging
+
+FTS_TABLE = 'pdfpage_fts'
+HIGHLIGHT_OPEN = '<mark>'
+HIGHLIGHT_CLOSE = '</mark>'
+SNIPPET_TOKENS = 40
+
+# External-content FTS5 table over pdfpage.gemini_analysis. The triggers live in library.db
+# itself, so every writer (ingest, delete, Drive-synced copies) keeps the two in step.
+_SCHEMA = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(gemini_analysis, content='pdfpage', content_rowid='id')",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON pdfpage BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, gemini_analysis) VALUES (new.id, new.gemini_analysis);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON pdfpage BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, gemini_analysis) VALUES ('delete', old.id, old.gemini_analysis);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF gemini_analysis ON pdfpage BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, gemini_analysis) VALUES ('delete', old.id, old.gemini_analysis);
+        INSERT INTO {FTS_TABLE}(rowid, gemini_analysis) VALUES (new.id, new.gemini_analysis);
+    END""",
+]
+
+def match_expression(query):
+    """Turns free text into an FTS5 query: each whitespace-separated term becomes a quoted phrase, OR-ed together."""
+    phrases = []
+    for term in query.split():
+        tokens = re.findall(r'\w+', term)
+        if tokens: phrases.append('"' + ' '.join(tokens) + '"')
+    return ' OR '.join(phrases)
+
+class LexicalIndex:
+    """BM25 keyword search over the pages of one library.db."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._ready = False
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def ensure(self, build=True):
+        """Creates the FTS table and sync triggers if missing, back-filling existing pages. Returns False if unavailable.
+
+        With build=False a missing table is left missing, as back-filling a large library takes a while.
+        """
+        if self._ready:
+            return True
+        try:
+            conn = self._connect()
+            try:
+                exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (FTS_TABLE,)).fetchone()
+                has_pages = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='pdfpage'").fetchone()
+                if not has_pages or not (exists or build):
+                    return False
+                with conn:
+                    for statement in _SCHEMA: conn.execute(statement)
+                    if not exists:
+                        conn.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+                        logging.info(f"Built full-text index over pages in {self.db_path}")
+            finally:
+                conn.close()
+            self._ready = True
+        except sqlite3.Error as e:
+            logging.error(f"Full-text index unavailable for {self.db_path}: {e}")
+        return self._ready
+
+    def search(self, query, limit, doc_type=None, document_ids=None):
+        """Returns [(page_id, bm25_score, snippet)] best match first, or [] until the table was built by ensure()."""
+        expression = match_expression(query)
+        if not expression or not self.ensure(build=False):
+            return []
+        sql = (f"SELECT p.id, bm25({FTS_TABLE}), snippet({FTS_TABLE}, 0, ?, ?, '...', {SNIPPET_TOKENS}) "
+               f"FROM {FTS_TABLE} JOIN pdfpage p ON p.id = {FTS_TABLE}.rowid "
+               f"JOIN pdfdocument d ON d.id = p.document_id WHERE {FTS_TABLE} MATCH ?")
+        params = [HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, expression]
+        if doc_type is not None:
+            sql += " AND d.doc_type = ?"
+            params.append(doc_type)
+        if document_ids is not None:
+            document_ids = [int(d) for d in document_ids]
+            sql += f" AND p.document_id IN ({','.join('?' * len(document_ids)) or 'NULL'})"
+            params.extend(document_ids)
+        sql += f" ORDER BY bm25({FTS_TABLE}) LIMIT ?"
+        params.append(limit)
+        try:
+            conn = self._connect()
+            try:
+                rows = conn.execute(sql, params).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Full-text search failed in {self.db_path}: {e}")
+            return []
+        # Drop the ###SECTION### markers of the analysis text from the snippet.
+        return [(page_id, score, ' '.join(re.sub(r'#{3}\w+#{3}', ' ', snippet).split())) for page_id, score, snippet in rows]
@@ -4,6 +4,7 @@ import logging
 from app import create_app
 from drive_service import DriveService
 from vector_db import VectorDatabase
+from federated_search import FederatedSearch
 import config_manager
 
 def get_current_version():
@@ -56,13 +57,17 @@ def initialize_main_app(initialization_status_callback):
     app = create_app(Config)
     app.drive_service = drive
     app.year_folder_ids = YEAR_FOLDER_IDS
+    # Searches across the year repositories that are present locally, alongside app.vector_db.
+    app.federated_search = FederatedSearch({year: os.path.join(APP_DATA_DIR, year) for year in YEAR_FOLDER_IDS})
     
     with app.app_context():
         initialization_status_callback("Loading ML models and vector index...")
         if user_year:
             year_data_path = os.path.join(APP_DATA_DIR, user_year)
             vector_db_path = os.path.join(year_data_path)
-            app.vector_db = VectorDatabase(vector_db_path)
+            app.vector_db = VectorDatabase(vector_db_path, **config_manager.vector_db_options())
+            initialization_status_callback("Preparing keyword search...")
+            app.vector_db.lexical_index.ensure()
         else:
             app.vector_db = None
             logging.warning("No user year selected, vector database not loaded.")
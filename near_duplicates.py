@@ -0,0 +1,29 @@
+import re
+import hashlib
+import numpy as np
+
+# A page is a near-duplicate of another when both its embedding and its text agree: the
+# squared L2 distance of the (unit) embeddings is at most DUPLICATE_MAX_DISTANCE, i.e.
+# cosine similarity >= 0.975, and their shingle hashes differ in at most
+# DUPLICATE_MAX_SHINGLE_BITS of 64 bits. Requiring both keeps pages that say the same
+# thing in different words (or the same words about different things) apart.
+DUPLICATE_MAX_DISTANCE = 0.05
+DUPLICATE_MAX_SHINGLE_BITS = 3
+# Nearest indexed pages checked for each new page.
+DUPLICATE_CANDIDATES = 4
+SHINGLE_SIZE = 3
+
+def shingle_hash(text):
+    """Returns a 64-bit SimHash of the word 3-shingles of text; near-identical texts differ in few bits."""
+    words = re.findall(r'\w+', (text or '').lower())
+    if not words:
+        return 0
+    shingles = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    digests = np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little') for s in shingles], dtype=np.uint64)
+    bits = (digests[:, None] >> np.arange(64, dtype=np.uint64)) & np.uint64(1)
+    # Each bit is set where most shingles have it set.
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(digests)
+    return int(np.sum(np.uint64(1) << np.arange(64, dtype=np.uint64)[votes > 0], dtype=np.uint64))
+
+def is_near_duplicate(distance, hash_a, hash_b):
+    return distance <= DUPLICATE_MAX_DISTANCE and bin(hash_a ^ hash_b).count('1') <= DUPLICATE_MAX_SHINGLE_BITS
@@ -0,0 +1,89 @@
+import os
+import logging
+from collections import namedtuple
+from threading import Lock
+import numpy as np
+
+RELATED_PAGES_K = 10
+
+_CSR = namedtuple('_CSR', 'ids indptr neighbours scores rows')
+
+def _csr(ids, indptr, neighbours, scores):
+    return _CSR(ids, indptr, neighbours, scores, {page_id: row for row, page_id in enumerate(ids.tolist())})
+
+class NeighbourGraph:
+    """Top-k nearest-neighbour lists of indexed pages, stored in CSR form.
+
+    Row i lists the neighbours of page ids[i] as neighbours[indptr[i]:indptr[i + 1]], best
+    first, with their similarity scores alongside. Rows are found through a dict, so a lookup
+    costs the same however large the library is. Updates swap in new arrays as a whole, so
+    readers need no lock.
+    """
+
+    def __init__(self, path, k=RELATED_PAGES_K):
+        self.path = path
+        self.k = k
+        # False until the graph is built or loaded; incremental updates only apply to a built graph.
+        self.built = False
+        self._data = _csr(np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data.ids)
+
+    def neighbours_of(self, page_id):
+        """Returns [(neighbour_id, score)] for page_id, best first; empty if it is not in the graph."""
+        data = self._data
+        row = data.rows.get(page_id)
+        if row is None:
+            return []
+        start, end = data.indptr[row], data.indptr[row + 1]
+        return list(zip(data.neighbours[start:end].tolist(), data.scores[start:end].tolist()))
+
+    def replace_rows(self, rows):
+        """Applies {page_id: (neighbour_ids, scores)} to the graph; a value of None deletes the row."""
+        if not rows:
+            return
+        with self._lock:
+            data = self._data
+            lengths = np.diff(data.indptr)
+            keep = ~np.isin(data.ids, np.fromiter(rows.keys(), dtype=np.int64, count=len(rows)))
+            new = [(page_id, np.asarray(value[0], dtype=np.int64), np.asarray(value[1], dtype=np.float32))
+                   for page_id, value in rows.items() if value is not None]
+            entry_keep = np.repeat(keep, lengths)
+            ids = np.concatenate([data.ids[keep], np.array([page_id for page_id, _, _ in new], dtype=np.int64)])
+            lengths = np.concatenate([lengths[keep], np.array([len(n) for _, n, _ in new], dtype=np.int64)])
+            neighbours = np.concatenate([data.neighbours[entry_keep]] + [n for _, n, _ in new])
+            scores = np.concatenate([data.scores[entry_keep]] + [s for _, _, s in new])
+            self._data = _csr(ids, np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64), neighbours, scores)
+
+    def rows_referencing(self, page_ids):
+        """Returns the page ids whose neighbour lists contain any of page_ids."""
+        data = self._data
+        hit = np.isin(data.neighbours, np.asarray(page_ids, dtype=np.int64))
+        if not hit.any():
+            return np.empty(0, dtype=np.int64)
+        rows = np.unique(np.searchsorted(data.indptr, np.flatnonzero(hit), side='right') - 1)
+        return data.ids[rows]
+
+    def save(self):
+        # Through a file object, so np.savez does not append '.npz' to the temporary path.
+        tmp_path = self.path + '.tmp'
+        with self._lock:
+            data = self._data
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, ids=data.ids, indptr=data.indptr, neighbours=data.neighbours, scores=data.scores, k=np.int64(self.k))
+            os.replace(tmp_path, self.path)
+
+    def load(self):
+        """Reads the graph file if there is one. Returns whether a graph was loaded."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                self.k = int(data['k'])
+                self._data = _csr(data['ids'], data['indptr'], data['neighbours'], data['scores'])
+            self.built = True
+        except Exception as e:
+            logging.warning(f"Could not read related-pages graph '{self.path}': {e}. Ignoring it.")
+        return self.built
@@ -0,0 +1,204 @@
+import json
+import logging
+import numpy as np
+
+# One fixed-size row per indexed page, sorted by page id. Text never lives here; it is
+# read from library.db for the hits that are actually returned. text_hash is the hash of
+# the embedded text, so changed pages can be found without re-embedding everything.
+# canonical_id is the page whose vector stands for this one: the page itself, or the page
+# it nearly duplicates. shingle_hash is the SimHash of its text (see near_duplicates).
+RECORD_DTYPE = np.dtype([
+    ('id', '<i8'), ('document_id', '<i8'), ('page_number', '<i4'),
+    ('start_time_seconds', '<i8'), ('doc_type', '<i2'), ('document_name', '<i4'),
+    ('text_hash', 'V16'), ('canonical_id', '<i8'), ('shingle_hash', '<u8'),
+])
+NO_START_TIME = -1
+NO_TEXT_HASH = bytes(16)
+NO_SHINGLE_HASH = 0
+
+class PageMetadataStore:
+    """Array-backed page metadata with interned doc_type and document-name tables."""
+
+    def __init__(self):
+        self.records = np.empty(0, dtype=RECORD_DTYPE)
+        self.doc_types = []
+        self.document_names = []
+        self._doc_type_codes = {}
+        self._document_name_codes = {}
+        # {canonical id: [canonical id, duplicate ids...]} of the current records, built on first use.
+        self._groups = None
+        self._groups_records = None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, page_id):
+        return self._positions([page_id])[0] >= 0
+
+    def _intern(self, value, table, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(table)
+            table.append(value)
+        return code
+
+    def _positions(self, page_ids):
+        # Row position of each page id, or -1 where it is not stored.
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        if not len(self.records):
+            return np.full(len(page_ids), -1)
+        positions = np.minimum(np.searchsorted(self.records['id'], page_ids), len(self.records) - 1)
+        return np.where(self.records['id'][positions] == page_ids, positions, -1)
+
+    def upsert(self, rows):
+        """Stores rows of page metadata dicts, replacing existing entries.
+
+        Rows have an 'id' key and optionally a hex 'text_hash', a hex 'shingle_hash' and the
+        'canonical_id' of the page they duplicate.
+        """
+        if not rows:
+            return
+        new = np.empty(len(rows), dtype=RECORD_DTYPE)
+        for i, row in enumerate(rows):
+            start_time = row.get('start_time_seconds')
+            new[i] = (
+                row['id'], row['document_id'], row['page_number'],
+                NO_START_TIME if start_time is None else start_time,
+                self._intern(row['doc_type'], self.doc_types, self._doc_type_codes),
+                self._intern(row['document_name'], self.document_names, self._document_name_codes),
+                bytes.fromhex(row['text_hash']) if row.get('text_hash') else NO_TEXT_HASH,
+                row.get('canonical_id', row['id']),
+                int(row['shingle_hash'], 16) if row.get('shingle_hash') else NO_SHINGLE_HASH,
+            )
+        if (not len(self.records) or new['id'][0] > self.records['id'][-1]) and (np.diff(new['id']) > 0).all():
+            # Appending ids in increasing order, as a streaming rebuild does, needs no re-sort.
+            self.records = np.concatenate([self.records, new])
+            return
+        # Later rows win: keep the last occurrence of each id, new rows after old ones.
+        merged = np.concatenate([self.records, new])
+        _, last = np.unique(merged['id'][::-1], return_index=True)
+        self.records = merged[len(merged) - 1 - last]
+
+    def remove(self, page_ids):
+        if len(self.records):
+            self.records = self.records[~np.isin(self.records['id'], np.asarray(page_ids, dtype=np.int64))]
+
+    def _row_to_dict(self, record):
+        start_time = int(record['start_time_seconds'])
+        return {
+            'document_id': int(record['document_id']), 'page_number': int(record['page_number']),
+            'document_name': self.document_names[record['document_name']],
+            'doc_type': self.doc_types[record['doc_type']],
+            'start_time_seconds': None if start_time == NO_START_TIME else start_time,
+        }
+
+    def _row_to_full_dict(self, record):
+        # The inverse of upsert, for writing rows back, e.g. to a delta log.
+        return {'id': int(record['id']), **self._row_to_dict(record), 'text_hash': record['text_hash'].tobytes().hex(),
+                'canonical_id': int(record['canonical_id']), 'shingle_hash': f"{int(record['shingle_hash']):016x}"}
+
+    def get(self, page_id):
+        position = self._positions([page_id])[0]
+        return None if position < 0 else self._row_to_dict(self.records[position])
+
+    def get_many(self, page_ids):
+        """Returns {page_id: metadata} for the stored ids among page_ids."""
+        positions = self._positions(page_ids)
+        return {int(self.records['id'][p]): self._row_to_dict(self.records[p]) for p in positions if p >= 0}
+
+    def rows(self, page_ids):
+        """Returns the full rows of the stored ids among page_ids, as upsert takes them."""
+        return [self._row_to_full_dict(self.records[p]) for p in self._positions(page_ids) if p >= 0]
+
+    def ids(self):
+        return self.records['id']
+
+    def duplicate_ids(self):
+        """Returns the ids of pages stored as a near-duplicate of another page, which have no vector of their own."""
+        return self.records['id'][self.records['canonical_id'] != self.records['id']]
+
+    def vector_ids(self):
+        """Returns the ids of pages that have their own vector in the index."""
+        return self.records['id'][self.records['canonical_id'] == self.records['id']]
+
+    def canonical_ids(self, page_ids):
+        """Maps each of page_ids to the id of the page whose vector stands for it; unknown ids map to themselves."""
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        positions = self._positions(page_ids)
+        return np.where(positions >= 0, self.records['canonical_id'][np.maximum(positions, 0)] if len(self.records) else page_ids, page_ids)
+
+    def shingle_hashes(self, page_ids):
+        """Returns {page_id: shingle hash} for the stored ids among page_ids."""
+        positions = self._positions(page_ids)
+        return {int(self.records['id'][p]): int(self.records['shingle_hash'][p]) for p in positions if p >= 0}
+
+    def locations(self, canonical_ids):
+        """Returns {canonical_id: [canonical_id, duplicate ids...]} for canonical_ids."""
+        records = self.records
+        if self._groups_records is not records:
+            # Rebuilt whenever the records array was replaced, i.e. after any upsert or remove.
+            duplicate = records['canonical_id'] != records['id']
+            groups = {}
+            for page_id, canonical_id in zip(records['id'][duplicate].tolist(), records['canonical_id'][duplicate].tolist()):
+                groups.setdefault(canonical_id, [canonical_id]).append(page_id)
+            self._groups, self._groups_records = groups, records
+        groups = self._groups
+        return {int(c): groups.get(int(c), [int(c)]) for c in canonical_ids}
+
+    def text_hashes(self):
+        """Returns the text hash of every page, aligned with ids(); NO_TEXT_HASH where unknown."""
+        return [h.tobytes() for h in self.records['text_hash']]
+
+    def select_ids(self, doc_type=None, document_ids=None):
+        """Returns the sorted page ids matching doc_type and, if given, belonging to one of document_ids."""
+        mask = np.ones(len(self.records), dtype=bool)
+        if doc_type is not None:
+            code = self._doc_type_codes.get(doc_type)
+            mask &= self.records['doc_type'] == (-1 if code is None else code)
+        if document_ids is not None:
+            mask &= np.isin(self.records['document_id'], np.asarray(list(document_ids), dtype=np.int64))
+        return self.records['id'][mask]
+
+    def copy(self):
+        store = PageMetadataStore()
+        store.records = self.records.copy()
+        store.doc_types = list(self.doc_types)
+        store.document_names = list(self.document_names)
+        store._doc_type_codes = dict(self._doc_type_codes)
+        store._document_name_codes = dict(self._document_name_codes)
+        return store
+
+    def save(self, records_path, names_path):
+        # Through a file object, so np.save does not append '.npy' to temporary paths.
+        with open(records_path, 'wb') as f: np.save(f, self.records, allow_pickle=False)
+        with open(names_path, 'w', encoding='utf-8') as f:
+            json.dump({'doc_types': self.doc_types, 'document_names': self.document_names}, f)
+
+    @classmethod
+    def load(cls, records_path, names_path, memory_map=False):
+        # A mapped store stays read-only on disk: upsert and remove always build new arrays.
+        store = cls()
+        store.records = np.load(records_path, mmap_mode='r' if memory_map else None, allow_pickle=False)
+        names = store.records.dtype.names or ()
+        if store.records.dtype != RECORD_DTYPE and set(names) < set(RECORD_DTYPE.names):
+            # Written by an older version: every page stands for itself, with unknown hashes.
+            records = np.zeros(len(store.records), dtype=RECORD_DTYPE)
+            for name in names: records[name] = store.records[name]
+            if 'canonical_id' not in names: records['canonical_id'] = records['id']
+            store.records = records
+        if store.records.dtype != RECORD_DTYPE:
+            raise ValueError(f"Unexpected page metadata layout in {records_path}: {store.records.dtype}")
+        with open(names_path, 'r', encoding='utf-8') as f: names = json.load(f)
+        store.doc_types = names['doc_types']
+        store.document_names = names['document_names']
+        store._doc_type_codes = {v: i for i, v in enumerate(store.doc_types)}
+        store._document_name_codes = {v: i for i, v in enumerate(store.document_names)}
+        return store
+
+    @classmethod
+    def from_page_map(cls, page_map):
+        """Converts a legacy {page_id: {...}} page_map, dropping the cached page content."""
+        store = cls()
+        store.upsert([{'id': page_id, **info} for page_id, info in page_map.items()])
+        logging.info(f"Converted legacy page_map with {len(store)} pages to the array-backed metadata store.")
+        return store
@@ -1,9 +1,10 @@
 import os
+import asyncio
 import logging
 import PyPDF2
 from PyPDF2 import PdfWriter
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from gemini_client import GeminiClient
+from gemini_client import GeminiClient, plan_analysis_batches
+from async_ingest import iterate_async, map_unordered
 
 gemini_client = GeminiClient()
 
@@ -35,22 +36,29 @@ def _extract_enhanced_text_from_analysis(analysis_text):
         logging.error(f"Error parsing enhanced text: {e}")
         return analysis_text.strip() # Fallback to returning the full analysis
 
+def _remove_temp_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Could not remove temporary file {path}: {e}")
+
 class PDFProcessor:
     def __init__(self, config):
         self.config = config
 
-    def _analyze_page_worker(self, page_job):
-        job_type, data, page_number, original_filename, api_key = page_job
+    async def _analyze_jobs_async(self, page_jobs):
+        """Analyses one image page, or a batch of text pages in a single request. Returns their page data."""
+        job_type, data, page_number, original_filename, api_key = page_jobs[0]
         
-        analysis_result = ""
-        raw_text = ""
-        
-        if job_type == 'text':
-            raw_text = self._clean_text(data)
-            analysis_result = gemini_client.analyze_page_for_indexing(raw_text, original_filename, api_key)
-        elif job_type == 'image':
+        if job_type == 'image':
             single_page_path = data
-            analysis_result = gemini_client.analyze_pdf_page_for_indexing(single_page_path, page_number, original_filename, api_key)
+            try:
+                analysis_result = await gemini_client.analyze_pdf_page_for_indexing_async(single_page_path, page_number, original_filename, api_key)
+            finally:
+                # The single-page PDF is removed whether the analysis succeeded, failed or was cancelled.
+                _remove_temp_file(single_page_path)
             
             # --- START OF THE FIX ---
             # After visual analysis, extract the rich text and use it as the primary text_content.
@@ -58,54 +66,74 @@ class PDFProcessor:
             raw_text = _extract_enhanced_text_from_analysis(analysis_result)
             # --- END OF THE FIX ---
 
-            if os.path.exists(single_page_path):
-                os.remove(single_page_path)
+            return [{
+                'page_number': page_number,
+                'text_content': raw_text, # This will now always have content if analysis was successful
+                'gemini_analysis': analysis_result,
+            }]
+
+        texts = [job[1] for job in page_jobs]
+        analyses = await gemini_client.analyze_pages_for_indexing_async(texts, original_filename, api_key)
+        return [{'page_number': job[2], 'text_content': text, 'gemini_analysis': analysis}
+                for job, text, analysis in zip(page_jobs, texts, analyses)]
 
-        return {
-            'page_number': page_number,
-            'text_content': raw_text, # This will now always have content if analysis was successful
-            'gemini_analysis': analysis_result,
-        }
+    def _batch_jobs(self, page_jobs):
+        """Each image page is analysed on its own; text pages are grouped into batched requests."""
+        text_jobs = [job for job in page_jobs if job[0] == 'text']
+        batches = [[text_jobs[i] for i in batch] for batch in plan_analysis_batches([job[1] for job in text_jobs])]
+        return [[job] for job in page_jobs if job[0] == 'image'] + batches
 
     def process_pdf(self, file_path, doc_id, api_key, original_filename):
+        """Yields {"status_text"} and {"page_data"} events while the pages are analysed on the ingestion loop."""
+        return iterate_async(self.process_pdf_async(file_path, doc_id, api_key, original_filename))
+
+    async def process_pdf_async(self, file_path, doc_id, api_key, original_filename):
         try:
             with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
+                # PyPDF2 parsing is blocking, CPU-bound work; it runs off the event loop.
+                pdf_reader = await asyncio.to_thread(PyPDF2.PdfReader, file)
                 num_pages = len(pdf_reader.pages)
                 
                 yield {"status_text": f"Extracting text (0/{num_pages})"}
                 
-                page_jobs = []
-                for i in range(num_pages):
-                    page = pdf_reader.pages[i]
-                    raw_text = page.extract_text() or ""
-                    page_number = i + 1
-                    
-                    if len(raw_text.strip()) < 100:
-                        single_page_path = self._extract_single_page(file_path, i)
-                        if single_page_path:
-                            page_jobs.append(('image', single_page_path, page_number, original_filename, api_key))
-                    else:
-                        page_jobs.append(('text', raw_text, page_number, original_filename, api_key))
+                page_jobs = await asyncio.to_thread(self._page_jobs, pdf_reader, file_path, original_filename, api_key)
                 
                 processed_count = 0
-                with ThreadPoolExecutor(max_workers=10) as executor:
-                    future_to_page = {executor.submit(self._analyze_page_worker, job): job for job in page_jobs}
-                    
-                    for future in as_completed(future_to_page):
-                        try:
-                            result = future.result()
+                analyses = map_unordered(self._analyze_jobs_async, self._batch_jobs(page_jobs))
+                try:
+                    async for jobs, results, exc in analyses:
+                        if exc is not None:
+                            logging.error(f'Pages {[job[2] for job in jobs]} generated an exception: {exc}')
+                            continue
+                        for result in results:
                             processed_count += 1
                             yield {"status_text": f"Processing page {processed_count}/{num_pages}"}
                             yield {"page_data": result}
-                        except Exception as exc:
-                            page_num_err = future_to_page[future][2]
-                            logging.error(f'Page {page_num_err} generated an exception: {exc}')
+                finally:
+                    # If the caller stopped early, analyses still waiting to start never remove their page files.
+                    await analyses.aclose()
+                    for job in page_jobs:
+                        if job[0] == 'image': _remove_temp_file(job[1])
 
         except Exception as e:
             logging.error(f"Error processing PDF file {file_path}: {str(e)}", exc_info=True)
             raise
 
+    def _page_jobs(self, pdf_reader, file_path, original_filename, api_key):
+        page_jobs = []
+        for i in range(len(pdf_reader.pages)):
+            page = pdf_reader.pages[i]
+            raw_text = page.extract_text() or ""
+            page_number = i + 1
+            
+            if len(raw_text.strip()) < 100:
+                single_page_path = self._extract_single_page(file_path, i)
+                if single_page_path:
+                    page_jobs.append(('image', single_page_path, page_number, original_filename, api_key))
+            else:
+                page_jobs.append(('text', self._clean_text(raw_text), page_number, original_filename, api_key))
+        return page_jobs
+
     def _extract_single_page(self, original_path, page_index):
         try:
             base, _ = os.path.splitext(os.path.basename(original_path))
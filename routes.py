@@ -18,9 +18,12 @@ from models import PDFDocument, PDFPage, ChatMessage
 from pdf_processor import PDFProcessor
 from youtube_processor import YouTubeProcessor
 from gemini_client import GeminiClient
+from analysis_cache import get_analysis_cache
+from gemini_governor import get_governor
+from gemini_handles import get_handle_registry
 import config_manager
 import numpy as np
-from vector_db import VectorDatabase
+from vector_db import VectorDatabase, PUBLISH_MAX_LOG_BYTES, PUBLISH_MAX_LOG_AGE
 
 sync_lock = Lock()
 sync_status = {"status": "pending", "message": "Waiting to start..."}
@@ -55,16 +58,18 @@ def sync_processed_files_to_drive(app, doc, year, vector_db_instance):
             folder_id = app.year_folder_ids.get(year)
             if not folder_id: raise Exception(f"No Drive folder ID for year {year}.")
             
-            files_to_upload = [
-                os.path.join(vector_db_instance.index_path_base, "library.db"),
-                vector_db_instance.faiss_index_path,
-                vector_db_instance.page_map_path
-            ]
+            # Students replay the uploaded delta log into memory, and map the snapshot again once it is
+            # republished; that happens when the log grows large or old, not on every ingest.
+            vector_db_instance.publish_snapshot(PUBLISH_MAX_LOG_BYTES, PUBLISH_MAX_LOG_AGE)
+            files_to_upload = [os.path.join(vector_db_instance.index_path_base, "library.db")]
+            files_to_upload.extend(vector_db_instance.index_file_paths())
             if doc.doc_type == 'pdf' and os.path.exists(doc.file_path):
                  files_to_upload.append(doc.file_path)
             
-            for f_path in files_to_upload:
-                if os.path.exists(f_path): app.drive_service.upload_file(f_path, folder_id)
+            # Compaction publishes its snapshots under the same lock, so the set uploaded is never half-replaced.
+            with vector_db_instance.files_lock:
+                for f_path in files_to_upload:
+                    if os.path.exists(f_path): app.drive_service.upload_file(f_path, folder_id)
         except Exception as e:
             logging.error(f"Failed to sync files for doc {doc.id} to Drive: {e}", exc_info=True)
 
@@ -133,10 +138,12 @@ def orchestrate_master_processing(app_context, content_identifier, original_file
                         session.add(PDFPage(document_id=doc_id, **page_data))
                     session.commit()
                     if is_admin_repo: update_admin_status(f"Indexing for admin...")
-                    vector_db_instance = VectorDatabase(repo_path)
-                    vector_db_instance.add_document(doc_id)
-                    if is_admin_repo: update_admin_status(f"Syncing admin files to Drive...")
-                    sync_processed_files_to_drive(current_app, doc, repo_year, vector_db_instance)
+                    # Federated search must not hold the files mapped while snapshots replace them.
+                    with current_app.federated_search.released(repo_year):
+                        vector_db_instance = VectorDatabase(repo_path)
+                        vector_db_instance.add_documents([doc_id])
+                        if is_admin_repo: update_admin_status(f"Syncing admin files to Drive...")
+                        sync_processed_files_to_drive(current_app, doc, repo_year, vector_db_instance)
                 finally:
                     session.close()
 
@@ -475,6 +482,8 @@ def chat_message():
     data = request.json
     user_message = data.get('message', '').strip()
     content_type_filter = data.get('filter', 'all')
+    document_ids = data.get('document_ids') # Optional: restrict retrieval to these documents.
+    years = data.get('years') # Optional: search these year repositories together instead of the current one.
     if not user_message: return jsonify({'error': 'Empty message.'}), 400
     api_key = config_manager.load_api_key()
     if not api_key: return jsonify({'response': 'Error: API key is not configured.'}), 400
@@ -482,7 +491,10 @@ def chat_message():
         gemini_client = GeminiClient()
         history = db.session.execute(db.select(ChatMessage).filter_by(user_id=current_user.id).order_by(ChatMessage.created_date.desc()).limit(5)).scalars().all()
         enhanced_query = gemini_client.refine_query_for_search(user_message, reversed(history), api_key)
-        search_results = current_app.vector_db.search(enhanced_query, top_k=5, content_type_filter=content_type_filter)
+        if years:
+            search_results = current_app.federated_search.search(enhanced_query, years=years, top_k=5, content_type_filter=content_type_filter, hybrid=True)
+        else:
+            search_results = current_app.vector_db.search(enhanced_query, top_k=5, content_type_filter=content_type_filter, document_ids=document_ids, hybrid=True)
         ai_response = gemini_client.generate_response(user_message, search_results, api_key)
         context_json = json.dumps(search_results, cls=NumpyEncoder)
         new_msg = ChatMessage(user_id=current_user.id, user_message=user_message, ai_response=ai_response, context_pages=context_json)
@@ -499,16 +511,60 @@ def search():
     query = request.args.get('q', '').strip()
     results = []
     if query:
-        search_results = current_app.vector_db.search(query, top_k=20)
+        search_results = current_app.vector_db.search(query, top_k=20, hybrid=True)
         page_ids = [res['page_id'] for res in search_results]
         pages = db.session.query(PDFPage).filter(PDFPage.id.in_(page_ids)).options(joinedload(PDFPage.document)).all()
         page_map = {page.id: page for page in pages}
         for res in search_results:
             page = page_map.get(res['page_id'])
             if page:
-                results.append({'document': page.document, 'page': page, 'score': res['score'], 'snippet': res.get('snippet', '')})
+                also_in = [location for location in res.get('locations', []) if location['page_id'] != res['page_id']]
+                results.append({'document': page.document, 'page': page, 'score': res['score'], 'snippet': res.get('snippet', ''), 'also_in': also_in})
     return render_template('search.html', query=query, results=results)
 
+@main_routes.route('/search/federated')
+@login_required
+def federated_search():
+    query = request.args.get('q', '').strip()
+    years = request.args.getlist('years') or None
+    if not query:
+        return jsonify({'error': 'Empty query.'}), 400
+    results = current_app.federated_search.search(query, years=years, top_k=request.args.get('top_k', 20, type=int),
+                                                  content_type_filter=request.args.get('filter', 'all'), hybrid=True)
+    return Response(json.dumps({'query': query, 'years': current_app.federated_search.available_years(), 'results': results}, cls=NumpyEncoder),
+                    content_type='application/json')
+
+@main_routes.route('/search/cache-stats')
+@login_required
+@admin_required
+def search_cache_stats():
+    if not current_app.vector_db:
+        return jsonify({'error': 'Vector database not loaded.'}), 503
+    return jsonify(current_app.vector_db.cache_stats())
+
+@main_routes.route('/analysis-cache/stats')
+@login_required
+@admin_required
+def analysis_cache_stats():
+    return jsonify(get_analysis_cache().stats())
+
+@main_routes.route('/gemini/stats')
+@login_required
+@admin_required
+def gemini_stats():
+    return jsonify({**get_governor().stats(), 'handles': get_handle_registry().stats()})
+
+@main_routes.route('/analysis-cache/purge', methods=['POST'])
+@login_required
+@admin_required
+def purge_analysis_cache():
+    """Forgets every cached Gemini page analysis, e.g. after changing models, so pages are analyzed afresh."""
+    try:
+        return jsonify({'status': 'success', **get_analysis_cache().purge()})
+    except Exception as e:
+        logging.error(f"Failed to purge analysis cache: {e}", exc_info=True)
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @main_routes.route('/initializing')
 @login_required
 def initializing():
@@ -550,7 +606,7 @@ def loading_page():
         db.engines['library'] = db.create_engine(library_db_uri)
         with current_app.app_context():
             db.create_all(bind_key='library')
-        current_app.vector_db = VectorDatabase(year_path)
+        current_app.vector_db = VectorDatabase(year_path, **config_manager.vector_db_options())
     except Exception as e:
         logging.error(f"Failed to configure services for year {user_year}: {e}", exc_info=True)
         flash(f"A critical error occurred while initializing your library: {e}", "error")
@@ -586,11 +642,15 @@ def get_sync_status():
                             if not to_download:
                                 sync_status = {"status": "complete", "message": "Library is up to date."}
                                 return
-                            for i, f_info in enumerate(to_download):
-                                f_name = [k for k, v in drive_map.items() if v['id'] == f_info['id']][0]
-                                sync_status = {"status": "syncing", "message": f"Downloading ({i+1}/{len(to_download)}): {f_name}"}
-                                app.drive_service.download_file(f_info['id'], os.path.join(year_path, f_name))
-                                local_manifest[f_name] = {'modifiedTime': f_info['modifiedTime']}
+                            if getattr(app, 'vector_db', None):
+                                # Release memory-mapped index files before they are overwritten.
+                                app.vector_db.load_into_memory()
+                            with app.federated_search.released(user_year):
+                                for i, f_info in enumerate(to_download):
+                                    f_name = [k for k, v in drive_map.items() if v['id'] == f_info['id']][0]
+                                    sync_status = {"status": "syncing", "message": f"Downloading ({i+1}/{len(to_download)}): {f_name}"}
+                                    app.drive_service.download_file(f_info['id'], os.path.join(year_path, f_name))
+                                    local_manifest[f_name] = {'modifiedTime': f_info['modifiedTime']}
                             with open(manifest_path, 'w') as f: json.dump(local_manifest, f)
                             sync_status = {"status": "complete", "message": "Sync complete!"}
                         except Exception as e:
@@ -613,10 +673,20 @@ def reload_services():
                 db.get_engine(bind='library').dispose()
             db.engines['library'] = db.create_engine(library_db_uri, pool_recycle=300, pool_pre_ping=True)
         if current_app.vector_db:
-            current_app.vector_db.load_index()
-            if current_app.vector_db.faiss_index.ntotal == 0:
-                logging.warning("Index is empty after load. Triggering a full build as a fallback.")
-                current_app.vector_db.build_full_index()
+            # Snapshots written by the rebuild or reconcile replace files federated search may have mapped.
+            with current_app.federated_search.released(user_year):
+                current_app.vector_db.load_index()
+                def report_rebuild(text):
+                    processing_status['index_rebuild'] = {"text": text, "complete": False}
+                if current_app.vector_db.faiss_index.ntotal == 0:
+                    logging.warning("Index is empty after load. Triggering a full build as a fallback.")
+                    current_app.vector_db.build_full_index(progress_callback=report_rebuild)
+                    processing_status['index_rebuild'] = {"text": "Index rebuilt", "complete": True}
+                else:
+                    # Only pages that are missing, stale or changed since the last sync are re-embedded.
+                    changes = current_app.vector_db.reconcile(progress_callback=report_rebuild)
+                    if changes is not None:
+                        processing_status['index_rebuild'] = {"text": "Index up to date", "complete": True, "changes": changes}
         if config_manager.is_admin():
             logging.info("Admin user detected. Reloading main admin vector index in memory.")
             current_app.vector_db.load_index()
@@ -662,8 +732,10 @@ def delete_document(doc_id):
                     if doc.doc_type == 'pdf':
                         folder_id = current_app.year_folder_ids.get(year)
                         current_app.drive_service.delete_file_by_name(original_filename, folder_id)
-                    vector_db_instance = VectorDatabase(year_path)
-                    vector_db_instance.remove_document(doc_in_year.id)
+                    # Federated search must not hold the files mapped while snapshots replace them.
+                    with current_app.federated_search.released(year):
+                        vector_db_instance = VectorDatabase(year_path)
+                        vector_db_instance.remove_document(doc_in_year.id)
                     if doc.doc_type == 'pdf' and os.path.exists(doc_in_year.file_path):
                         os.remove(doc_in_year.file_path)
                     session.delete(doc_in_year)
@@ -725,6 +797,15 @@ def view_document(doc_id):
         embed_url = get_youtube_embed_url(doc.file_path)
     return render_template('view_document.html', document=doc, embed_url=embed_url)
 
+@main_routes.route('/document/<int:doc_id>/page/<int:page_number>/related')
+@login_required
+def related_pages(doc_id, page_number):
+    if not current_app.vector_db:
+        return jsonify({'error': 'Vector database not loaded.'}), 503
+    page = db.session.query(PDFPage.id).filter_by(document_id=doc_id, page_number=page_number).first()
+    related = current_app.vector_db.related_pages(page.id, limit=request.args.get('limit', 5, type=int)) if page else []
+    return Response(json.dumps({'related': related}, cls=NumpyEncoder), content_type='application/json')
+
 @main_routes.route('/uploads/<int:doc_id>')
 @login_required
 def serve_pdf(doc_id):
@@ -3,6 +3,7 @@ import sys
 import logging
 import webbrowser
 import time
+import multiprocessing
 from threading import Timer, Thread
 from flask import Flask, render_template, jsonify
 import waitress
@@ -67,6 +68,8 @@ def check_main_app():
         return jsonify({"ready": False})
 
 if __name__ == "__main__":
+    # The bulk embedding pool spawns worker processes, which re-enter this executable when frozen.
+    multiprocessing.freeze_support()
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
     main_app_thread = Thread(target=run_main_app, daemon=True)
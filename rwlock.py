@@ -0,0 +1,45 @@
+from contextlib import contextmanager
+from threading import Condition, Lock
+
+class ReadWriteLock:
+    """Lets any number of readers hold the lock at once, or a single writer.
+
+    Waiting writers go ahead of newly arriving readers, so a steady stream of searches
+    cannot starve a swap. Neither side is re-entrant.
+    """
+
+    def __init__(self):
+        self._condition = Condition(Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers: self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers:
+                    self._condition.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
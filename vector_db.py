@@ -1,41 +1,739 @@
 import os
+import copy
+import json
 import pickle
+import sqlite3
+import zlib
+import struct
+import time
 import logging
+from threading import Lock, RLock, Thread, get_ident
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
 from sqlalchemy.orm import joinedload, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
 from models import PDFPage
+from embedding_cache import EmbeddingCache, text_hash
+from page_metadata import PageMetadataStore, NO_TEXT_HASH
+from query_cache import LRUCache
+from lexical_index import LexicalIndex
+from delta_log import DeltaLog
+from rwlock import ReadWriteLock
+from neighbour_graph import NeighbourGraph, RELATED_PAGES_K
+from near_duplicates import shingle_hash, is_near_duplicate, DUPLICATE_CANDIDATES
+from embedders import Embedder, EMBEDDER_BACKENDS, DEFAULT_EMBEDDER_BACKEND, MODEL_NAME, get_embedder
 
-MODEL_NAME = 'all-MiniLM-L6-v2'
+# 'flat' is an exact brute-force scan; 'ivf_flat', 'ivf_pq' and 'hnsw' are approximate.
+# 'auto' stays flat for small libraries and migrates to IVF-Flat once it crosses the threshold.
+INDEX_TYPES = ('auto', 'flat', 'ivf_flat', 'ivf_pq', 'hnsw')
+DEFAULT_INDEX_TYPE = 'auto'
+ANN_MIGRATION_THRESHOLD = 20000
+IVF_MIN_TRAINING_VECTORS = 2048
+PQ_MIN_TRAINING_VECTORS = 39 * 256 # 256 centroids per sub-quantizer
+IVF_MAX_TRAINING_VECTORS = 100000
+IVF_NPROBE = 16
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+# Id map entry of a vector removed from an index that cannot remove in place (see remove_ids).
+DELETED_ID = -1
+
+# 'sq8' stores one byte per dimension (4x smaller); 'pq' stores 8 dims per byte (~32x smaller).
+# With rescore, the top RESCORE_K_FACTOR * k candidates are re-ranked on exact vectors. Those are
+# a full float32 copy of every vector kept next to the codes, so a rescored index is larger than
+# a flat one (23.1 MB for sq8+rescore against 18.5 MB flat at ~12k 384-dim vectors): it buys
+# recall, not memory. It is off by default, and student copies never turn it on for indexes they
+# build themselves.
+QUANTIZATION_TYPES = ('none', 'sq8', 'pq')
+DEFAULT_QUANTIZATION = 'none'
+DEFAULT_RESCORE = False
+SQ_MIN_TRAINING_VECTORS = 1000
+RESCORE_K_FACTOR = 4
+
+# Query embeddings are shared by every repository using the same model; search results are
+# cached per VectorDatabase and keyed by its index version.
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+SEARCH_RESULT_CACHE_SIZE = 512
+
+# Hybrid search fuses the vector and BM25 rankings by reciprocal rank, taking
+# HYBRID_CANDIDATE_FACTOR * top_k candidates from each.
+HYBRID_CANDIDATE_FACTOR = 2
+RRF_K = 60
+
+# add_document/remove_document append to a delta log instead of rewriting the snapshot.
+# The log is folded into a new snapshot in the background once it outgrows these bounds.
+DELTA_COMPACTION_MIN_BYTES = 16 * 1024 * 1024
+DELTA_COMPACTION_RATIO = 0.5
+# Copies of the files (e.g. on Drive) ship with the delta log, which readers replay into memory.
+# publish_snapshot folds it in once it outgrows PUBLISH_MAX_LOG_BYTES or its snapshot is older
+# than PUBLISH_MAX_LOG_AGE seconds, so an ingest does not rewrite the whole snapshot every time.
+PUBLISH_MAX_LOG_BYTES = 4 * 1024 * 1024
+PUBLISH_MAX_LOG_AGE = 24 * 60 * 60
+
+# faiss_index.idx and page_meta.npy end with the generation of their snapshot, so the loader
+# checks them by reading a few bytes rather than checksumming them. FAISS and numpy ignore it.
+SNAPSHOT_STAMP = struct.Struct('<4sQ') # magic, generation
+SNAPSHOT_STAMP_MAGIC = b'LWSG'
+
+# build_full_index streams pages from SQLite in batches of this size. Each encoded batch is
+# appended to a rebuild log, so an interrupted rebuild resumes after the last one.
+REBUILD_BATCH_SIZE = 512
+
+# Full rebuilds shard their texts across a pool of ENCODE_PROCESSES worker processes once at
+# least BULK_ENCODE_MIN_TEXTS need encoding. Each worker loads its own copy of the model, so the
+# pool is kept small. Incremental ingest and reconcile, and any encode with encode_processes <= 1,
+# stay in-process.
+ENCODE_PROCESSES = max(1, min(4, (os.cpu_count() or 1) // 2))
+BULK_ENCODE_MIN_TEXTS = 256
+
+# With collapse_duplicates, a page that nearly duplicates an indexed page (repeated title
+# slides, headers, boilerplate) gets no vector of its own; search returns the page once, with
+# every (document, page) location it appears at.
+DEFAULT_COLLAPSE_DUPLICATES = True
+
+_query_embeddings = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+
+def _ivf_nlist(num_vectors):
+    # ~4*sqrt(n) lists, but keep at least 39 training points per centroid.
+    return max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+
+def _pq_subquantizers(dimension):
+    # Largest divisor of the dimension that still leaves 8 dims per sub-vector.
+    return max(m for m in range(1, dimension // 8 + 1) if dimension % m == 0)
+
+def target_layout(index_type, quantization, rescore, num_vectors):
+    """Resolves the configured mode to the (index_type, quantization, rescore) to build for num_vectors."""
+    if index_type == 'auto':
+        index_type = 'ivf_flat' if num_vectors >= ANN_MIGRATION_THRESHOLD else 'flat'
+    if index_type == 'ivf_pq' or (index_type == 'ivf_flat' and quantization == 'pq'):
+        index_type, quantization = 'ivf_pq', 'pq'
+    min_training = {'none': 0, 'sq8': SQ_MIN_TRAINING_VECTORS, 'pq': PQ_MIN_TRAINING_VECTORS}[quantization]
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        min_training = max(min_training, IVF_MIN_TRAINING_VECTORS)
+    if num_vectors < min_training:
+        # Not enough vectors to train the quantizers yet; store raw vectors until there are.
+        index_type = 'hnsw' if index_type == 'hnsw' else 'flat'
+        quantization = 'none'
+    return index_type, quantization, bool(rescore) and quantization != 'none'
+
+def _index_chain(index):
+    # Walks ID-mapping and refinement wrappers down to the index that holds the codes.
+    index = faiss.downcast_index(index)
+    while True:
+        yield index
+        if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            index = faiss.downcast_index(index.index)
+        elif isinstance(index, faiss.IndexRefine):
+            index = faiss.downcast_index(index.base_index)
+        else:
+            return
+
+def index_layout(index):
+    chain = list(_index_chain(index))
+    rescore = any(isinstance(i, faiss.IndexRefine) for i in chain)
+    storage = chain[-1]
+    if isinstance(storage, faiss.IndexIVFPQ): return 'ivf_pq', 'pq', rescore
+    if isinstance(storage, faiss.IndexIVFScalarQuantizer): return 'ivf_flat', 'sq8', rescore
+    if isinstance(storage, faiss.IndexIVF): return 'ivf_flat', 'none', rescore
+    index_type = 'flat'
+    if isinstance(storage, faiss.IndexHNSW):
+        index_type, storage = 'hnsw', faiss.downcast_index(storage.storage)
+    if isinstance(storage, faiss.IndexScalarQuantizer): return index_type, 'sq8', rescore
+    if isinstance(storage, faiss.IndexPQ): return index_type, 'pq', rescore
+    return index_type, 'none', rescore
+
+def configure_search(index):
+    for i in _index_chain(index):
+        if isinstance(i, faiss.IndexIVF): i.nprobe = IVF_NPROBE
+        elif isinstance(i, faiss.IndexHNSW): i.hnsw.efSearch = HNSW_EF_SEARCH
+        elif isinstance(i, faiss.IndexRefine): i.k_factor = RESCORE_K_FACTOR
+
+def create_faiss_index(dimension, layout, training_vectors=None):
+    """Creates an empty index for layout that supports add_with_ids, trained on training_vectors if needed."""
+    index_type, quantization, rescore = layout
+    encoding = {'none': "Flat", 'sq8': "SQ8", 'pq': f"PQ{_pq_subquantizers(dimension)}"}[quantization]
+    if index_type == 'flat':
+        description = f"IDMap,{encoding}"
+    elif index_type == 'hnsw':
+        # IDMap2 so vectors can be reconstructed by ID; HNSW cannot remove in place.
+        description = f"IDMap2,HNSW{HNSW_M}" + ("" if quantization == 'none' else f"_{encoding}")
+    else:
+        # IVF stores IDs natively and must not sit under a plain IDMap, but the refine
+        # wrapper cannot take IDs itself, so rescored IVF goes through IDMap2.
+        num_training = min(len(training_vectors), IVF_MAX_TRAINING_VECTORS)
+        description = f"{'IDMap2,' if rescore else ''}IVF{_ivf_nlist(num_training)},{encoding}"
+    if rescore:
+        # Keeps full-precision vectors alongside the codes to re-rank the top candidates exactly.
+        description += ",RFlat"
+    index = faiss.index_factory(dimension, description)
+    if not index.is_trained:
+        if len(training_vectors) > IVF_MAX_TRAINING_VECTORS:
+            sample = np.random.default_rng(0).choice(len(training_vectors), IVF_MAX_TRAINING_VECTORS, replace=False)
+            training_vectors = training_vectors[np.sort(sample)]
+        index.train(training_vectors)
+    configure_search(index)
+    return index
+
+def _search_parameters(index, selector, exhaustive):
+    if isinstance(index, faiss.IndexRefine):
+        base_params = _search_parameters(faiss.downcast_index(index.base_index), selector, exhaustive)
+        return faiss.IndexRefineSearchParameters(k_factor=RESCORE_K_FACTOR, base_index_params=base_params)
+    if isinstance(index, faiss.IndexIVF):
+        # Probing every list turns IVF into an exhaustive scan of the selected vectors.
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nlist if exhaustive else IVF_NPROBE)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=HNSW_EF_SEARCH)
+    return faiss.SearchParameters(sel=selector)
+
+def _exact_search(index, queries, k, positions):
+    # Scores the selected vectors exactly; positions are ids of index, or positions below an IDMap.
+    distances, labels = faiss.knn(queries, index.reconstruct_batch(positions), k)
+    return distances, positions[labels]
+
+def search_index(index, queries, k, allowed_ids=None):
+    """Searches index for the k nearest neighbours of queries, considering only allowed_ids if given.
+
+    Filtering happens inside FAISS, so every query gets min(k, len(allowed_ids)) results. Flat PQ
+    codes cannot be searched with a selector; their selected vectors are scored exactly instead.
+    """
+    index = faiss.downcast_index(index)
+    if allowed_ids is None:
+        distances, labels = index.search(queries, k)
+        if not (labels == DELETED_ID).any() or not has_deleted(index):
+            return distances, labels
+        # Deleted entries took some of the k places; search the remaining ones only.
+        allowed_ids = index_ids(index)
+    id_map = None
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        # Select on internal positions and search the wrapped index directly, so the
+        # selector also reaches indexes below a refine stage.
+        id_map = faiss.vector_to_array(index.id_map).astype(np.int64)
+        index = faiss.downcast_index(index.index)
+        allowed_ids = np.flatnonzero(np.isin(id_map, allowed_ids)).astype(np.int64)
+    else:
+        allowed_ids = np.ascontiguousarray(allowed_ids, dtype=np.int64)
+    k = min(k, len(allowed_ids))
+    if k == 0:
+        return np.empty((len(queries), 0), dtype='float32'), np.empty((len(queries), 0), dtype=np.int64)
+
+    chain = list(_index_chain(index))
+    if isinstance(chain[-1], faiss.IndexPQ):
+        # IndexPQ::search asserts that no selector is given, also below a refine stage.
+        return _restore_ids(*_exact_search(index, queries, k, allowed_ids), id_map)
+    selector = faiss.IDSelectorBatch(len(allowed_ids), faiss.swig_ptr(allowed_ids))
+    try:
+        distances, labels = index.search(queries, k, params=_search_parameters(index, selector, exhaustive=False))
+    except RuntimeError as e:
+        # An index type without selector support; the filter must still hold.
+        logging.warning(f"Filtered search is not supported by {type(index).__name__} ({e}). Scoring the selected vectors exactly.")
+        distances, labels = _exact_search(index, queries, k, allowed_ids)
+    if (labels == -1).any():
+        if isinstance(chain[-1], faiss.IndexHNSW):
+            # A selective filter can disconnect the graph walk; score the selected vectors exactly.
+            distances, labels = _exact_search(index, queries, k, allowed_ids)
+        else:
+            distances, labels = index.search(queries, k, params=_search_parameters(index, selector, exhaustive=True))
+    return _restore_ids(distances, labels, id_map)
+
+def _restore_ids(distances, labels, id_map):
+    # Maps labels found below an IDMap back to ids.
+    if id_map is not None:
+        labels = np.where(labels >= 0, id_map[np.maximum(labels, 0)], -1)
+    return distances, labels
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merges ranked id lists into [(id, score)] best first, scoring each id by sum(1 / (k + rank))."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
+
+def _stamp_file(path, generation):
+    with open(path, 'ab') as f: f.write(SNAPSHOT_STAMP.pack(SNAPSHOT_STAMP_MAGIC, generation))
+
+def _file_stamp(path):
+    # The snapshot generation stamped at the end of path, or None.
+    if os.path.getsize(path) < SNAPSHOT_STAMP.size:
+        return None
+    with open(path, 'rb') as f:
+        f.seek(-SNAPSHOT_STAMP.size, os.SEEK_END)
+        magic, generation = SNAPSHOT_STAMP.unpack(f.read(SNAPSHOT_STAMP.size))
+    return generation if magic == SNAPSHOT_STAMP_MAGIC else None
+
+def _file_crc32(path, chunk_size=1 << 20):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk: return crc
+            crc = zlib.crc32(chunk, crc)
+
+# Snapshot files of one directory are replaced and uploaded under one lock, shared by every
+# VectorDatabase of that directory, so a Drive sync never uploads a half-published snapshot.
+_index_files_locks = {}
+_index_files_locks_lock = Lock()
+
+def index_files_lock(index_base_path):
+    """Returns the lock held while the snapshot files under index_base_path are replaced or read as a set."""
+    key = os.path.normcase(os.path.abspath(index_base_path))
+    with _index_files_locks_lock:
+        return _index_files_locks.setdefault(key, RLock())
+
+def index_memory_estimate(index):
+    """Approximate bytes an index created by create_faiss_index takes in memory, without copying it."""
+    total = 0
+    for i in _index_chain(index):
+        if isinstance(i, faiss.IndexIDMap2):
+            # The reverse map is a hash table of id -> position, about 32 bytes per entry.
+            total += i.ntotal * (8 + 32)
+        elif isinstance(i, faiss.IndexIDMap):
+            total += i.ntotal * 8
+        elif isinstance(i, faiss.IndexRefine):
+            refine_index = faiss.downcast_index(i.refine_index)
+            total += refine_index.ntotal * refine_index.sa_code_size()
+        elif isinstance(i, faiss.IndexHNSW):
+            storage = faiss.downcast_index(i.storage)
+            total += storage.ntotal * storage.sa_code_size() + i.hnsw.neighbors.size() * 4 + i.hnsw.offsets.size() * 8 + i.hnsw.levels.size() * 4
+        elif isinstance(i, faiss.IndexIVF):
+            # Each list entry holds its code and its id; the coarse quantizer holds the centroids.
+            total += i.ntotal * (i.code_size + 8) + i.nlist * i.d * 4
+        else:
+            total += i.ntotal * i.sa_code_size()
+    return total
+
+def index_ids(index):
+    """Returns the ids of every entry of an index created by create_faiss_index, without reconstructing vectors."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+        return ids[ids != DELETED_ID]
+    if isinstance(index, faiss.IndexIVF):
+        invlists = index.invlists
+        return np.concatenate([np.empty(0, dtype=np.int64)] + [
+            faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+            for l in range(index.nlist) if invlists.list_size(l) > 0
+        ])
+    return np.arange(index.ntotal, dtype=np.int64)
+
+def export_vectors(index):
+    """Returns (ids, vectors) for every entry of an index created by create_faiss_index."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+        live = ids != DELETED_ID
+        return ids[live], faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)[live]
+    ids = index_ids(index)
+    if isinstance(index, faiss.IndexIVF):
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        try:
+            vectors = index.reconstruct_batch(ids) if len(ids) else np.empty((0, index.d), dtype='float32')
+        finally:
+            index.set_direct_map_type(faiss.DirectMap.NoMap)
+        return ids, vectors
+    return ids, index.reconstruct_n(0, index.ntotal)
+
+def reconstruct_vectors(index, ids):
+    """Returns the stored vectors of ids, which must all be in an index created by create_faiss_index."""
+    index = faiss.downcast_index(index)
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        id_map = faiss.vector_to_array(index.id_map).astype(np.int64)
+        order = np.argsort(id_map)
+        positions = order[np.searchsorted(id_map, ids, sorter=order)].astype(np.int64)
+        return faiss.downcast_index(index.index).reconstruct_batch(positions)
+    if isinstance(index, faiss.IndexIVF):
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        try:
+            return index.reconstruct_batch(ids)
+        finally:
+            index.set_direct_map_type(faiss.DirectMap.NoMap)
+    return index.reconstruct_batch(ids)
+
+def remove_ids(index, ids):
+    """Removes ids from an index created by create_faiss_index. Returns the number of entries removed.
+
+    HNSW graphs, and IVF lists below a refine stage, cannot drop entries in place. Their ids are
+    only marked DELETED_ID in the id map, which searches skip, until without_deleted rebuilds the index.
+    """
+    index = faiss.downcast_index(index)
+    chain = list(_index_chain(index))
+    refine = next((i for i in chain if isinstance(i, faiss.IndexRefine)), None)
+    if refine is None and not isinstance(chain[-1], faiss.IndexHNSW):
+        return index.remove_ids(faiss.IDSelectorArray(np.ascontiguousarray(ids, dtype=np.int64)))
+    # A writable view of the id map; the positions of the entries to remove are those of their ids.
+    id_map = faiss.rev_swig_ptr(index.id_map.data(), index.id_map.size())
+    positions = np.flatnonzero(np.isin(id_map, ids)).astype(np.int64)
+    if not len(positions):
+        return 0
+    if isinstance(chain[-1], (faiss.IndexHNSW, faiss.IndexIVF)):
+        id_map[positions] = DELETED_ID
+    else:
+        # Flat codes and the refine stage's full vectors both shift later entries down in order,
+        # so they stay aligned with each other and with the compacted id map.
+        selector = faiss.IDSelectorArray(positions)
+        refine.base_index.remove_ids(selector)
+        refine.refine_index.remove_ids(selector)
+        refine.ntotal = index.ntotal = refine.base_index.ntotal
+        faiss.copy_array_to_vector(np.delete(id_map, positions), index.id_map)
+    if isinstance(index, faiss.IndexIDMap2): index.construct_rev_map()
+    return len(positions)
+
+def has_deleted(index):
+    """Returns whether remove_ids left entries of index marked deleted."""
+    index = faiss.downcast_index(index)
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) and bool((faiss.vector_to_array(index.id_map) == DELETED_ID).any())
+
+def without_deleted(index):
+    """Returns a copy of index without the entries marked deleted, keeping its trained quantizers."""
+    ids, vectors = export_vectors(index)
+    index = faiss.clone_index(index)
+    index.reset()
+    if len(ids): index.add_with_ids(vectors, ids)
+    configure_search(index)
+    return index
 
 class VectorDatabase:
-    def __init__(self, index_base_path):
+    def __init__(self, index_base_path, model_name=MODEL_NAME, index_type=None, quantization=None, rescore=None, memory_map=False,
+                 encode_processes=None, embedder=None, collapse_duplicates=None):
+        # Mode arguments left as None are restored from the saved index, or fall back to the defaults.
+        # rescore=True keeps a float32 copy of every vector in the index (see DEFAULT_RESCORE).
+        # With memory_map, the saved index and page metadata are mapped read-only instead of read
+        # into RAM, and only copied into memory once the index is mutated.
+        # encode_processes sizes the worker pool of full rebuilds (default ENCODE_PROCESSES; 1 disables it).
+        # embedder is a backend name from EMBEDDER_BACKENDS or an Embedder; when None, the
+        # backend and model the saved index was built with are used.
+        # collapse_duplicates applies to pages indexed from then on (default DEFAULT_COLLAPSE_DUPLICATES).
         if not index_base_path:
             raise ValueError("VectorDatabase requires a valid index_base_path.")
+        if index_type is not None and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index_type '{index_type}'. Expected one of {INDEX_TYPES}.")
+        if quantization is not None and quantization not in QUANTIZATION_TYPES:
+            raise ValueError(f"Unknown quantization '{quantization}'. Expected one of {QUANTIZATION_TYPES}.")
+        if isinstance(embedder, str) and embedder not in EMBEDDER_BACKENDS:
+            raise ValueError(f"Unknown embedder backend '{embedder}'. Expected one of {EMBEDDER_BACKENDS}.")
             
-        self.model = SentenceTransformer(MODEL_NAME)
-        self.dimension = self.model.get_sentence_embedding_dimension()
+        self._requested_embedder = embedder
+        self._requested_mode = {'index_type': index_type, 'quantization': quantization, 'rescore': rescore,
+                                'collapse_duplicates': collapse_duplicates}
+        self.index_type = index_type or DEFAULT_INDEX_TYPE
+        self.quantization = quantization or DEFAULT_QUANTIZATION
+        self.rescore = DEFAULT_RESCORE if rescore is None else rescore
+        self.collapse_duplicates = DEFAULT_COLLAPSE_DUPLICATES if collapse_duplicates is None else collapse_duplicates
         self.faiss_index = None
-        self.page_map = {}
+        self.pages = PageMetadataStore()
+        self.memory_map = memory_map
+        self.encode_processes = ENCODE_PROCESSES if encode_processes is None else encode_processes
+        self._mapped = False
+        self.index_version = 0
+        self.generation = 0
+        self._search_results = LRUCache(SEARCH_RESULT_CACHE_SIZE)
+        # Guards the in-memory index against snapshotting while it is being mutated.
+        self._persist_lock = RLock()
+        # Searches read the index and page metadata under the read side; in-place mutations and
+        # swapping in a reloaded or rebuilt index take the write side, which is held only briefly.
+        self._index_lock = ReadWriteLock()
+        self._compaction_thread = None
         
         self.index_path_base = index_base_path
         os.makedirs(self.index_path_base, exist_ok=True)
+        self.files_lock = index_files_lock(self.index_path_base)
         
         self.faiss_index_path = os.path.join(self.index_path_base, 'faiss_index.idx')
-        self.page_map_path = os.path.join(self.index_path_base, 'page_map.pkl')
+        self.page_meta_path = os.path.join(self.index_path_base, 'page_meta.npy')
+        self.page_names_path = os.path.join(self.index_path_base, 'page_names.json')
+        # Pickled {page_id: {..., 'content': ...}} written by older versions; converted on load.
+        self.legacy_page_map_path = os.path.join(self.index_path_base, 'page_map.pkl')
+        self.library_db_path = os.path.join(self.index_path_base, 'library.db')
+        self.lexical_index = LexicalIndex(self.library_db_path)
+        self.index_meta_path = os.path.join(self.index_path_base, 'index_meta.json')
+        self.rebuild_state_path = os.path.join(self.index_path_base, 'index_rebuild.json')
+        self.rebuild_index_path = os.path.join(self.index_path_base, 'index_rebuild.idx')
+        self.related_pages_path = os.path.join(self.index_path_base, 'related_pages.npz')
+        self.neighbour_graph = NeighbourGraph(self.related_pages_path)
+        if isinstance(embedder, Embedder):
+            self._set_embedder(embedder)
+        else:
+            saved = self._read_index_meta() if embedder is None else {}
+            self._set_embedder(get_embedder(embedder or saved.get('embedder', DEFAULT_EMBEDDER_BACKEND), saved.get('model_name', model_name)))
         
         self.load_index()
 
+    def _set_embedder(self, embedder):
+        # The delta logs and the embedding cache are specific to the embedder's vector space.
+        self.embedder = embedder
+        self.delta_log = DeltaLog(os.path.join(self.index_path_base, 'index_delta.log'), embedder.dimension)
+        self.rebuild_log = DeltaLog(os.path.join(self.index_path_base, 'index_rebuild.log'), embedder.dimension)
+        self.embedding_cache = EmbeddingCache(self.index_path_base, embedder.cache_name, embedder.dimension)
+
+    @property
+    def model_name(self):
+        return self.embedder.model_name
+
+    @property
+    def dimension(self):
+        return self.embedder.dimension
+
+    def _encode_texts(self, texts, show_progress_bar=False, bulk=False):
+        # bulk lets large sets of cache misses go to the embedder's multi-process path, which
+        # returns embeddings in input order, so the result is the same either way.
+        def encode(batch):
+            if bulk and self.encode_processes > 1 and len(batch) >= BULK_ENCODE_MIN_TEXTS:
+                return self.embedder.encode_bulk(batch, self.encode_processes)
+            return self.embedder.encode(batch, show_progress_bar=show_progress_bar)
+        return self.embedding_cache.encode(texts, encode)
+
+    def encode_queries(self, queries):
+        """Returns float32 query embeddings, from the process-wide query cache where possible."""
+        vectors = np.empty((len(queries), self.dimension), dtype='float32')
+        misses = []
+        for i, query in enumerate(queries):
+            vector = _query_embeddings.get((self.embedder.cache_name, query))
+            if vector is None: misses.append(i)
+            else: vectors[i] = vector
+        if misses:
+            encoded = self.embedder.encode([queries[i] for i in misses])
+            for i, vector in zip(misses, encoded):
+                vectors[i] = vector
+                _query_embeddings.put((self.embedder.cache_name, queries[i]), vector)
+        return vectors
+
+    def _bump_index_version(self):
+        # Cached results are keyed by version; clearing just frees the stale entries early.
+        self.index_version += 1
+        self._search_results.clear()
+
+    def cache_stats(self):
+        return {'index_version': self.index_version, 'query_embeddings': _query_embeddings.stats(), 'search_results': self._search_results.stats()}
+
+    def _target_layout(self, num_vectors):
+        return target_layout(self.index_type, self.quantization, self.rescore, num_vectors)
+
     def _initialize_faiss_index(self):
-        index = faiss.IndexFlatL2(self.dimension)
-        self.faiss_index = faiss.IndexIDMap(index)
-        self.page_map = {}
-        logging.info("Initialized a new, empty FAISS IndexIDMap.")
+        layout = self._target_layout(0)
+        index = create_faiss_index(self.dimension, layout)
+        with self._index_lock.write():
+            self.faiss_index = index
+            self.pages = PageMetadataStore()
+            self._mapped = False
+        self._bump_index_version()
+        logging.info(f"Initialized a new, empty FAISS index {layout}.")
+
+    def _set_index(self, ids, vectors):
+        """Replaces the FAISS index with one of the configured mode holding exactly these vectors."""
+        index = create_faiss_index(self.dimension, self._target_layout(len(ids)), vectors)
+        if len(ids): index.add_with_ids(vectors, ids)
+        self.faiss_index = index
+
+    def _maybe_migrate_index(self):
+        current = index_layout(self.faiss_index)
+        wanted = self._target_layout(self.faiss_index.ntotal)
+        # Only migrate away from untrained layouts; a trained index is kept until the next rebuild.
+        if current == wanted or current[0] not in ('flat', 'hnsw') or current[1] != 'none':
+            return
+        logging.info(f"Index reached {self.faiss_index.ntotal} vectors. Migrating from {current} to {wanted}...")
+        ids, vectors = export_vectors(self.faiss_index)
+        self._set_index(ids, vectors)
+        logging.info(f"Index migration to {wanted} complete.")
+
+    def _remove_ids(self, ids):
+        self.load_into_memory()
+        return remove_ids(self.faiss_index, ids)
+
+    def _drop_deleted(self):
+        # Entries only marked deleted are rebuilt away before a snapshot is written; searches
+        # continue on the old index meanwhile. Called under _persist_lock.
+        if not has_deleted(self.faiss_index):
+            return
+        index = without_deleted(self.faiss_index)
+        with self._index_lock.write():
+            self.faiss_index = index
+            self._bump_index_version()
+        logging.info(f"Dropped deleted entries from the index, which has {index.ntotal} vectors.")
+
+    @property
+    def memory_mapped(self):
+        return self._mapped
+
+    def memory_usage(self):
+        """Approximate bytes the index and page metadata take in memory when they are not memory-mapped."""
+        with self._index_lock.read():
+            return index_memory_estimate(self.faiss_index) + self.pages.records.nbytes
+
+    def load_into_memory(self):
+        """Replaces a memory-mapped index with an in-memory copy, releasing its files so they can be overwritten."""
+        with self._persist_lock:
+            if not self._mapped:
+                return
+            try:
+                index = faiss.clone_index(self.faiss_index)
+            except RuntimeError:
+                # Memory-mapped IVF lists cannot be cloned; nothing has changed since the load, so re-read the file.
+                index = faiss.read_index(self.faiss_index_path)
+            configure_search(index)
+            self.faiss_index = index
+            self.pages.records = np.array(self.pages.records)
+            self._mapped = False
+            logging.info(f"Copied memory-mapped index from {self.index_path_base} into memory.")
+
+    def _add_pages(self, ids, vectors, rows):
+        # Re-adding a page replaces its vector, which also makes delta log replay idempotent.
+        # rows may hold more pages than ids: near-duplicates are stored without a vector.
+        self.load_into_memory()
+        row_ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        present = row_ids[np.isin(row_ids, self.pages.vector_ids())]
+        if len(present): self._remove_ids(present)
+        if len(ids): self.faiss_index.add_with_ids(vectors, ids)
+        self.pages.upsert(rows)
+
+    def _assign_duplicates(self, index, pages, ids, vectors, rows):
+        """Points the rows of new pages that nearly duplicate a page of index, or an earlier page of
+        the batch, at that page. Returns a mask of the pages that keep a vector of their own."""
+        keep = np.ones(len(ids), dtype=bool)
+        if not self.collapse_duplicates or not len(ids):
+            return keep
+        hashes = [int(row['shingle_hash'], 16) for row in rows]
+        indexed = [[] for _ in range(len(ids))]
+        if index.ntotal:
+            distances, labels = search_index(index, vectors, min(DUPLICATE_CANDIDATES, index.ntotal))
+            known = pages.shingle_hashes(np.unique(labels[labels != -1]))
+            indexed = [[(float(d), int(l), known[l]) for d, l in zip(row_distances, row_labels) if l in known]
+                       for row_distances, row_labels in zip(distances, labels)]
+        batch_distances, batch_positions = faiss.knn(vectors, vectors, min(DUPLICATE_CANDIDATES + 1, len(ids)))
+        for i in range(len(ids)):
+            candidates = indexed[i] + [(float(d), int(ids[j]), hashes[j]) for d, j in zip(batch_distances[i], batch_positions[i])
+                                       if 0 <= j < i and keep[j]]
+            for distance, canonical_id, other_hash in sorted(candidates):
+                if is_near_duplicate(distance, hashes[i], other_hash):
+                    rows[i]['canonical_id'] = canonical_id
+                    keep[i] = False
+                    break
+        return keep
+
+    def _persist_delta(self, layout_before, append):
+        """Logs one mutation, or writes a full snapshot when the index layout changed or none exists yet."""
+        if index_layout(self.faiss_index) != layout_before or not os.path.exists(self.faiss_index_path):
+            self.save_index()
+            return
+        try:
+            append()
+        except Exception as e:
+            logging.error(f"Failed to append to delta log, writing a full snapshot instead: {e}")
+            self.save_index()
+            return
+        self._maybe_start_compaction()
+
+    def _maybe_start_compaction(self):
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        snapshot_size = os.path.getsize(self.faiss_index_path) if os.path.exists(self.faiss_index_path) else 0
+        if self.delta_log.size() < max(DELTA_COMPACTION_MIN_BYTES, snapshot_size * DELTA_COMPACTION_RATIO):
+            return
+        self._compaction_thread = Thread(target=self.compact, daemon=True)
+        self._compaction_thread.start()
+
+    def compact(self):
+        """Folds the delta log into a new snapshot. Mutations may continue while it is written."""
+        with self._persist_lock:
+            self._drop_deleted()
+            index_bytes = faiss.serialize_index(self.faiss_index)
+            pages = self.pages.copy()
+            meta = self._index_meta()
+            base_generation = self.generation
+            log_offset = self.delta_log.size()
+        logging.info(f"Compacting delta log of {log_offset} bytes into a new snapshot in {self.index_path_base}...")
+        try:
+            self._write_snapshot(index_bytes, pages, meta, base_generation, log_offset)
+        except Exception as e:
+            logging.error(f"Delta log compaction failed: {e}", exc_info=True)
+
+    def publish_snapshot(self, max_log_bytes=0, max_log_age=0):
+        """Folds pending delta log records into the snapshot, so copies of the files (e.g. on Drive)
+        load memory-mapped instead of replaying the log into an in-memory index.
+
+        Only does so once the log holds more than max_log_bytes or the snapshot is older than
+        max_log_age seconds; by default whenever the log has any records.
+        """
+        thread = self._compaction_thread
+        if thread is not None and thread.is_alive(): thread.join()
+        if not self.delta_log.has_records():
+            return
+        snapshot_age = time.time() - os.path.getmtime(self.index_meta_path) if os.path.exists(self.index_meta_path) else 0
+        if self.delta_log.size() > max_log_bytes or snapshot_age > max_log_age:
+            self.compact()
+
+    def _write_snapshot(self, index_bytes, pages, meta, base_generation, log_offset=None):
+        """Writes the snapshot next to the live files and publishes it with atomic renames.
+
+        index_meta.json is replaced last and records the generation with the size of the other
+        files, which are stamped with the generation (or, for the small page_names.json, checksummed),
+        so the loader can tell a set left half-replaced (by a crash or a partial download) from a
+        consistent one without reading the index. Delta log records after log_offset were not in
+        the snapshot and are carried over.
+        """
+        generation = base_generation + 1
+        targets = [self.faiss_index_path, self.page_meta_path, self.page_names_path, self.index_meta_path]
+        # Per writer, as a background compaction may be writing a snapshot at the same time.
+        tmp_paths = [f"{path}.{os.getpid()}-{get_ident()}.tmp" for path in targets]
+        with open(tmp_paths[0], 'wb') as f: f.write(index_bytes.tobytes())
+        pages.save(tmp_paths[1], tmp_paths[2])
+        for tmp_path in tmp_paths[:2]: _stamp_file(tmp_path, generation)
+        files = {os.path.basename(path): {'size': os.path.getsize(tmp_path)} for tmp_path, path in zip(tmp_paths[:3], targets[:3])}
+        files[os.path.basename(targets[2])]['crc32'] = _file_crc32(tmp_paths[2])
+        with open(tmp_paths[3], 'w') as f: json.dump({**meta, 'generation': generation, 'files': files}, f, indent=4)
+        with self._persist_lock, self.files_lock:
+            if self.generation != base_generation:
+                # A newer snapshot was published while this one was being written.
+                for path in tmp_paths: os.remove(path)
+                return
+            self.load_into_memory() # A mapped file cannot be replaced on Windows.
+            for tmp_path, path in zip(tmp_paths, targets): os.replace(tmp_path, path)
+            self.delta_log.rebase(generation, log_offset)
+            self.generation = generation
+            if os.path.exists(self.legacy_page_map_path): os.remove(self.legacy_page_map_path)
+
+    def _rebuild_training_vectors(self, session, total):
+        # A random sample of pages, encoded batch by batch; the embedding cache means the
+        # streaming pass does not encode these pages a second time.
+        sample_ids = [row.id for row in session.query(PDFPage.id).filter(PDFPage.gemini_analysis != None)
+                      .order_by(func.random()).limit(min(total, IVF_MAX_TRAINING_VECTORS))]
+        vectors = np.empty((len(sample_ids), self.dimension), dtype='float32')
+        for start in range(0, len(sample_ids), REBUILD_BATCH_SIZE):
+            chunk = sample_ids[start:start + REBUILD_BATCH_SIZE]
+            analyses = dict(session.query(PDFPage.id, PDFPage.gemini_analysis).filter(PDFPage.id.in_(chunk)).all())
+            vectors[start:start + len(chunk)] = self._encode_texts([self._extract_section(analyses[i], "ENHANCED_TEXT") for i in chunk], bulk=True)
+        return vectors
+
+    def _resume_rebuild(self, layout):
+        """Returns (index, pages) holding the batches of an interrupted rebuild of layout, or None."""
+        if not (os.path.exists(self.rebuild_state_path) and os.path.exists(self.rebuild_index_path)):
+            return None
+        try:
+            with open(self.rebuild_state_path, 'r') as f: state = json.load(f)
+            if state.get('layout') != list(layout) or state.get('embedder') != self.embedder.cache_name:
+                return None
+            index = faiss.read_index(self.rebuild_index_path)
+            pages = PageMetadataStore()
+            for _, ids, vectors, rows in self.rebuild_log.replay():
+                if len(ids): index.add_with_ids(vectors, ids)
+                pages.upsert(rows)
+            configure_search(index)
+            return index, pages
+        except Exception as e:
+            logging.warning(f"Could not resume the interrupted index rebuild: {e}. Starting over.")
+            return None
+
+    def _clear_rebuild_state(self):
+        for path in (self.rebuild_state_path, self.rebuild_index_path, self.rebuild_log.path):
+            if os.path.exists(path): os.remove(path)
 
-    def build_full_index(self):
+    def build_full_index(self, progress_callback=None):
+        """Rebuilds the index from library.db in bounded memory, resuming an interrupted rebuild if possible.
+
+        The live index keeps serving searches until the rebuilt one is swapped in at the end.
+        progress_callback, if given, is called with a status text after every batch.
+        """
         logging.info(f"Performing full index rebuild in '{self.index_path_base}'...")
+        report = progress_callback or (lambda text: None)
         db_path = os.path.join(self.index_path_base, "library.db")
         if not os.path.exists(db_path):
             logging.warning("Cannot build index: library.db not found.")
@@ -48,28 +746,62 @@ class VectorDatabase:
         session = Session()
 
         try:
-            self._initialize_faiss_index()
-            pages = session.query(PDFPage).options(joinedload(PDFPage.document)).filter(PDFPage.gemini_analysis != None).all()
-            if not pages:
+            self.lexical_index.ensure()
+            analyzed = PDFPage.gemini_analysis != None
+            total = session.query(func.count(PDFPage.id)).filter(analyzed).scalar()
+            if not total:
                 logging.warning("No processable pages found in the database.")
-                self.save_index()
+                with self._persist_lock:
+                    self._initialize_faiss_index()
+                    self.save_index()
                 return
 
-            all_texts = [self._extract_section(p.gemini_analysis, "ENHANCED_TEXT") for p in pages]
-            all_ids = np.array([p.id for p in pages], dtype=np.int64)
+            layout = self._target_layout(total)
+            resumed = self._resume_rebuild(layout)
+            if resumed:
+                index, pages = resumed
+                logging.info(f"Resuming interrupted rebuild after {len(pages)} pages.")
+            else:
+                self._clear_rebuild_state()
+                needs_training = layout[0] in ('ivf_flat', 'ivf_pq') or layout[1] != 'none'
+                if needs_training: report("Training index quantizers...")
+                index = create_faiss_index(self.dimension, layout, self._rebuild_training_vectors(session, total) if needs_training else None)
+                pages = PageMetadataStore()
+                faiss.write_index(index, self.rebuild_index_path)
+                with open(self.rebuild_state_path, 'w') as f: json.dump({'layout': list(layout), 'embedder': self.embedder.cache_name}, f)
 
-            for page in pages:
-                self.page_map[page.id] = {
-                    'document_id': page.document.id, 'page_number': page.page_number,
-                    'document_name': page.document.original_filename, 
-                    'doc_type': page.document.doc_type, 'start_time_seconds': page.start_time_seconds,
-                    'content': self._extract_section(page.gemini_analysis, "ENHANCED_TEXT")
-                }
-            
-            logging.info(f"Encoding {len(all_texts)} documents...")
-            embeddings = self.model.encode(all_texts, convert_to_tensor=False, show_progress_bar=True)
-            self.faiss_index.add_with_ids(embeddings.astype('float32'), all_ids)
-            self.save_index()
+            # Hashes of every page text, to drop stale cache entries at the end; unknown after a resume.
+            text_keys = None if resumed else set()
+            last_id = int(pages.ids()[-1]) if len(pages) else -1
+            while True:
+                batch = (session.query(PDFPage).options(joinedload(PDFPage.document)).filter(analyzed, PDFPage.id > last_id)
+                         .order_by(PDFPage.id).limit(REBUILD_BATCH_SIZE).all())
+                if not batch: break
+                texts = [self._extract_section(page.gemini_analysis, "ENHANCED_TEXT") for page in batch]
+                ids = np.array([page.id for page in batch], dtype=np.int64)
+                rows = [self._page_metadata(page, text) for page, text in zip(batch, texts)]
+                vectors = self._encode_texts(texts, bulk=True)
+                keep = self._assign_duplicates(index, pages, ids, vectors, rows)
+                if keep.any(): index.add_with_ids(vectors[keep], ids[keep])
+                pages.upsert(rows)
+                self.rebuild_log.append_add(ids[keep], vectors[keep], rows, 0)
+                if text_keys is not None: text_keys.update(text_hash(t) for t in texts)
+                last_id = int(ids[-1])
+                session.expunge_all()
+                report(f"Indexed {len(pages)}/{total} pages...")
+
+            with self._persist_lock:
+                with self._index_lock.write():
+                    self.faiss_index = index
+                    self.pages = pages
+                    self._mapped = False
+                    self._bump_index_version()
+                self.save_index()
+            self._clear_rebuild_state()
+            if text_keys is not None: self.embedding_cache.compact_keys(text_keys)
+            report("Linking related pages...")
+            self.build_neighbour_graph(progress_callback)
+            report(f"Index rebuilt with {self.faiss_index.ntotal} pages.")
             logging.info(f"Full index rebuild complete. Index contains {self.faiss_index.ntotal} vectors.")
 
         except Exception as e:
@@ -78,7 +810,13 @@ class VectorDatabase:
             session.close()
 
     def add_document(self, doc_id):
-        logging.info(f"Incrementally adding document {doc_id} to index.")
+        self.add_documents([doc_id])
+
+    def add_documents(self, doc_ids):
+        """Incrementally indexes the analyzed pages of doc_ids, encoding them together as one batch."""
+        doc_ids = [int(d) for d in doc_ids]
+        if not doc_ids: return
+        logging.info(f"Incrementally adding document(s) {doc_ids} to index.")
         db_path = os.path.join(self.index_path_base, "library.db")
         if not os.path.exists(db_path):
             logging.error(f"Cannot add document: library.db not found at {db_path}")
@@ -89,40 +827,233 @@ class VectorDatabase:
         session = Session()
         try:
             if self.faiss_index is None: self._initialize_faiss_index()
+            self.lexical_index.ensure()
 
-            if not isinstance(self.faiss_index, faiss.IndexIDMap):
-                logging.warning("Index was not an IndexIDMap. Re-wrapping.")
+            if isinstance(faiss.downcast_index(self.faiss_index), faiss.IndexFlat):
+                logging.warning("Index was a bare flat index without IDs. Re-wrapping.")
                 base_index = self.faiss_index
                 new_index = faiss.IndexIDMap(faiss.clone_index(base_index))
                 new_index.add_with_ids(base_index.reconstruct_n(0, base_index.ntotal), np.arange(base_index.ntotal))
                 self.faiss_index = new_index
             
-            pages = session.query(PDFPage).options(joinedload(PDFPage.document)).filter(PDFPage.document_id == doc_id, PDFPage.gemini_analysis != None).all()
+            pages = (session.query(PDFPage).options(joinedload(PDFPage.document))
+                     .filter(PDFPage.document_id.in_(doc_ids), PDFPage.gemini_analysis != None).order_by(PDFPage.id).all())
             if not pages: return
 
-            texts_to_add = []
-            ids_to_add = []
-            for page in pages:
-                enhanced_text = self._extract_section(page.gemini_analysis, "ENHANCED_TEXT")
-                texts_to_add.append(enhanced_text)
-                ids_to_add.append(page.id)
-                self.page_map[page.id] = {
-                    'document_id': page.document.id, 'page_number': page.page_number,
-                    'document_name': page.document.original_filename, 
-                    'doc_type': page.document.doc_type, 'start_time_seconds': page.start_time_seconds,
-                    'content': enhanced_text
-                }
-
-            if texts_to_add:
-                embeddings = self.model.encode(texts_to_add, convert_to_tensor=False)
-                self.faiss_index.add_with_ids(embeddings.astype('float32'), np.array(ids_to_add, dtype=np.int64))
-                self.save_index()
-                logging.info(f"Added {len(ids_to_add)} pages for doc {doc_id}. Index has {self.faiss_index.ntotal} vectors.")
+            self._index_pages(pages)
+            logging.info(f"Added {len(pages)} pages for document(s) {doc_ids}. Index has {self.faiss_index.ntotal} vectors.")
+        except Exception as e:
+            logging.error(f"Failed to add document(s) {doc_ids} to index: {e}", exc_info=True)
+        finally:
+            session.close()
+
+    def _index_pages(self, pages):
+        """Embeds pages (PDFPage rows with their document loaded) and adds them to the index, replacing older versions."""
+        texts = [self._extract_section(page.gemini_analysis, "ENHANCED_TEXT") for page in pages]
+        ids = np.array([page.id for page in pages], dtype=np.int64)
+        rows = [self._page_metadata(page, text) for page, text in zip(pages, texts)]
+        embeddings = self._encode_texts(texts)
+        with self._persist_lock:
+            # Older versions are removed first, so their duplicates get a new canonical page and
+            # the new versions are not matched against themselves.
+            present = ids[np.isin(ids, self.pages.ids())]
+            if len(present): self._unindex_pages(present)
+            keep = self._assign_duplicates(self.faiss_index, self.pages, ids, embeddings, rows)
+            ids, embeddings = ids[keep], embeddings[keep]
+            layout = index_layout(self.faiss_index)
+            with self._index_lock.write():
+                self._add_pages(ids, embeddings, rows)
+            # Migration builds the new index aside and swaps it in, so searches continue meanwhile.
+            self._maybe_migrate_index()
+            self._bump_index_version()
+            self._persist_delta(layout, lambda: self.delta_log.append_add(ids, embeddings, rows, self.generation))
+            self._update_neighbour_graph(added=ids)
+
+    def _unindex_pages(self, ids):
+        """Removes page ids from the index. Returns the number of vectors removed."""
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._persist_lock:
+            layout = index_layout(self.faiss_index)
+            self.load_into_memory()
+            promoted_ids, promoted_vectors, promoted_rows = self._promote_duplicates(ids)
+            # Duplicates have no vector; any other id may have one, including vectors without a row.
+            vector_ids = ids[~np.isin(ids, self.pages.duplicate_ids())]
+            with self._index_lock.write():
+                removed_count = self._remove_ids(vector_ids) if len(vector_ids) else 0
+                self.pages.remove(ids)
+                if promoted_rows: self._add_pages(promoted_ids, promoted_vectors, promoted_rows)
+                self._bump_index_version()
+
+            def append():
+                self.delta_log.append_remove(ids, self.generation)
+                if promoted_rows: self.delta_log.append_add(promoted_ids, promoted_vectors, promoted_rows, self.generation)
+            self._persist_delta(layout, append)
+            self._update_neighbour_graph(added=promoted_ids, removed=vector_ids)
+        return removed_count
+
+    def _promote_duplicates(self, ids):
+        """Picks a new canonical page for each duplicate group whose canonical page is among ids but other pages are not.
+
+        Returns (new canonical ids, the vectors of the pages they replace, updated rows of the
+        group's remaining pages). The removed page's vector is reused, so nothing is re-encoded.
+        """
+        removed = set(ids.tolist())
+        old_ids, new_ids, rows = [], [], []
+        for canonical_id, members in self.pages.locations(ids[np.isin(ids, self.pages.vector_ids())]).items():
+            remaining = [page_id for page_id in members if page_id not in removed]
+            if len(members) == 1 or not remaining: continue
+            old_ids.append(canonical_id)
+            new_ids.append(remaining[0])
+            rows.extend({**row, 'canonical_id': remaining[0]} for row in self.pages.rows(remaining))
+        if not old_ids:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dimension), dtype='float32'), []
+        return np.array(new_ids, dtype=np.int64), reconstruct_vectors(self.faiss_index, old_ids), rows
+
+    def _nearest_pages(self, page_ids, k):
+        """Returns {page_id: (neighbour_ids, scores)} with the k nearest other pages of each indexed page id."""
+        with self._index_lock.read():
+            # Called under _persist_lock, which also serialises the direct map IVF reconstruction needs.
+            vectors = reconstruct_vectors(self.faiss_index, page_ids)
+            distances, labels = search_index(self.faiss_index, vectors, min(k + 1, self.faiss_index.ntotal))
+        rows = {}
+        for page_id, row_distances, row_labels in zip(page_ids.tolist(), distances, labels):
+            found = (row_labels != -1) & (row_labels != page_id)
+            rows[page_id] = (row_labels[found][:k], (1.0 / (1.0 + row_distances[found][:k])).astype('float32'))
+        return rows
+
+    def build_neighbour_graph(self, progress_callback=None):
+        """Precomputes the related pages of every indexed page and saves them, replacing any older graph."""
+        report = progress_callback or (lambda text: None)
+        graph = NeighbourGraph(self.related_pages_path)
+        with self._persist_lock:
+            with self._index_lock.read():
+                page_ids = np.array(self.pages.vector_ids(), dtype=np.int64)
+            rows = {}
+            for start in range(0, len(page_ids), REBUILD_BATCH_SIZE):
+                rows.update(self._nearest_pages(page_ids[start:start + REBUILD_BATCH_SIZE], graph.k))
+                report(f"Linked related pages for {min(start + REBUILD_BATCH_SIZE, len(page_ids))}/{len(page_ids)} pages...")
+            graph.replace_rows(rows)
+            graph.built = True
+            graph.save()
+            self.neighbour_graph = graph
+        logging.info(f"Built related-pages graph over {len(graph)} pages.")
+
+    def _update_neighbour_graph(self, added=(), removed=()):
+        """Keeps the graph current after pages were added (or replaced) and removed, building it if there is none yet."""
+        graph = self.neighbour_graph
+        try:
+            if not graph.built:
+                # Libraries grown by add_document never went through build_full_index.
+                self.build_neighbour_graph()
+                return
+            removed = set(int(i) for i in removed)
+            rows = {page_id: None for page_id in removed}
+            # Pages that listed a removed page get their lists recomputed, as do the new pages.
+            recompute = (set(int(i) for i in added) | set(graph.rows_referencing(list(removed)).tolist())) - removed
+            if recompute and self.faiss_index.ntotal:
+                fresh = self._nearest_pages(np.array(sorted(recompute), dtype=np.int64), graph.k)
+                rows.update(fresh)
+                # A new page also enters the lists of the existing pages it is close to, where it beats their last entry.
+                updated = {}
+                for page_id in added:
+                    page_id = int(page_id)
+                    for neighbour, score in zip(*fresh[page_id]):
+                        neighbour = int(neighbour)
+                        if neighbour in rows: continue
+                        current = updated.get(neighbour) or graph.neighbours_of(neighbour)
+                        current = [(n, s) for n, s in current if n != page_id]
+                        if len(current) < graph.k or score > current[-1][1]:
+                            updated[neighbour] = sorted(current + [(page_id, float(score))], key=lambda entry: entry[1], reverse=True)[:graph.k]
+                rows.update({page_id: ([n for n, _ in entries], [s for _, s in entries]) for page_id, entries in updated.items()})
+            graph.replace_rows(rows)
+            graph.save()
+        except Exception as e:
+            logging.error(f"Failed to update related-pages graph: {e}", exc_info=True)
+
+    def related_pages(self, page_id, limit=RELATED_PAGES_K):
+        """Returns up to limit pages most similar to page_id, best first, from the precomputed graph."""
+        with self._index_lock.read():
+            # The graph links canonical pages; a duplicate shares the neighbours of its canonical page.
+            canonical_id = int(self.pages.canonical_ids([int(page_id)])[0])
+        neighbours = self.neighbour_graph.neighbours_of(canonical_id)[:limit]
+        with self._index_lock.read():
+            page_infos = self.pages.get_many([neighbour for neighbour, _ in neighbours])
+        return [{'page_id': neighbour, **page_infos[neighbour], 'score': score} for neighbour, score in neighbours if neighbour in page_infos]
+
+    def reconcile(self, progress_callback=None):
+        """Brings the index in line with the analyzed pages of library.db, embedding only what differs.
+
+        Pages are matched by id and by the hash of their text, so pages that are missing, stale
+        or changed (e.g. after a partial Drive sync) are fixed without a full rebuild. Pages indexed
+        before text hashes were stored keep their vector and only get their hash filled in. Returns
+        counts of the pages 'added', 'updated', 'removed', 'backfilled' and 'unchanged', or None on failure.
+        """
+        report = progress_callback or (lambda text: None)
+        db_path = os.path.join(self.index_path_base, "library.db")
+        if not os.path.exists(db_path):
+            logging.warning("Cannot reconcile index: library.db not found.")
+            return None
+
+        engine = create_engine(f"sqlite:///{db_path}")
+        Session = sessionmaker(bind=engine)
+        session = Session()
+        try:
+            if self.faiss_index is None: self._initialize_faiss_index()
+            # Searches never build the keyword index themselves; a library synced without one gets it here.
+            self.lexical_index.ensure()
+            report("Comparing index with library...")
+            db_hashes = {}
+            for page_id, analysis in (session.query(PDFPage.id, PDFPage.gemini_analysis)
+                                      .filter(PDFPage.gemini_analysis != None).yield_per(REBUILD_BATCH_SIZE)):
+                db_hashes[page_id] = text_hash(self._extract_section(analysis, "ENHANCED_TEXT"))
+            with self._index_lock.read():
+                indexed = dict(zip(self.pages.ids().tolist(), self.pages.text_hashes()))
+                # Vectors without a metadata row can never be returned; drop them with the stale pages.
+                vector_ids = set(self.pages.vector_ids().tolist())
+                orphans = set() if self.faiss_index.ntotal == len(vector_ids) else set(index_ids(self.faiss_index).tolist()) - vector_ids
+
+            removed = np.array(sorted((set(indexed) - set(db_hashes)) | orphans), dtype=np.int64)
+            added = sorted(set(db_hashes) - set(indexed))
+            backfilled = sorted(page_id for page_id, h in indexed.items() if page_id in db_hashes and h == NO_TEXT_HASH)
+            updated = sorted(page_id for page_id, h in indexed.items()
+                             if page_id in db_hashes and h not in (db_hashes[page_id], NO_TEXT_HASH))
+            changes = {'added': len(added), 'updated': len(updated), 'removed': len(removed), 'backfilled': len(backfilled),
+                       'unchanged': len(db_hashes) - len(added) - len(updated) - len(backfilled)}
+
+            if len(removed):
+                self._unindex_pages(removed)
+            if backfilled:
+                report(f"Recording text hashes of {len(backfilled)} pages...")
+                self._backfill_text_hashes({page_id: db_hashes[page_id] for page_id in backfilled})
+            to_index = sorted(added + updated)
+            for start in range(0, len(to_index), REBUILD_BATCH_SIZE):
+                batch_ids = to_index[start:start + REBUILD_BATCH_SIZE]
+                pages = (session.query(PDFPage).options(joinedload(PDFPage.document))
+                         .filter(PDFPage.id.in_(batch_ids)).order_by(PDFPage.id).all())
+                self._index_pages(pages)
+                session.expunge_all()
+                report(f"Re-indexed {min(start + REBUILD_BATCH_SIZE, len(to_index))}/{len(to_index)} changed pages...")
+            if not self.neighbour_graph.built and self.faiss_index.ntotal:
+                report("Linking related pages...")
+                self.build_neighbour_graph(progress_callback)
+            logging.info(f"Reconciled index with library.db: {changes}. Index has {self.faiss_index.ntotal} vectors.")
+            return changes
         except Exception as e:
-            logging.error(f"Failed to add document {doc_id} to index: {e}", exc_info=True)
+            logging.error(f"Error reconciling index: {e}", exc_info=True)
+            return None
         finally:
             session.close()
 
+    def _backfill_text_hashes(self, hashes):
+        """Stores {page_id: text hash} for pages indexed before hashes were kept, without re-embedding them."""
+        with self._persist_lock:
+            rows = self.pages.rows(list(hashes))
+            for row in rows: row['text_hash'] = hashes[row['id']].hex()
+            with self._index_lock.write():
+                self.pages.upsert(rows)
+            # A delta log record would re-add the pages' vectors, so the metadata goes out in a snapshot.
+            self.save_index()
+
     def remove_document(self, doc_id):
         if self.faiss_index is None or self.faiss_index.ntotal == 0: return
         logging.info(f"Incrementally removing document {doc_id} from index.")
@@ -137,48 +1068,145 @@ class VectorDatabase:
             ids_to_remove = np.array([page.id for page in pages_to_remove], dtype=np.int64)
             if len(ids_to_remove) == 0: return
 
-            removed_count = self.faiss_index.remove_ids(faiss.IDSelectorArray(ids_to_remove))
-            for page_id in ids_to_remove: self.page_map.pop(int(page_id), None)
-            self.save_index()
+            removed_count = self._unindex_pages(ids_to_remove)
             logging.info(f"Removed {removed_count} vectors for doc {doc_id}. Index has {self.faiss_index.ntotal} vectors.")
         except Exception as e:
             logging.error(f"Failed to remove document {doc_id} from index: {e}", exc_info=True)
         finally:
             session.close()
 
-    def search(self, query, top_k=10, content_type_filter='all'):
+    def search(self, query, top_k=10, content_type_filter='all', document_ids=None, hybrid=False):
+        """Returns the top_k pages for query, optionally restricted to a doc_type and/or a set of document ids.
+
+        With hybrid=True, semantic and BM25 keyword rankings are fused, so exact terms such as
+        course codes or formula names are found even when their embedding is not close. Results
+        are then ordered by their 'fused_score'; 'score' stays the vector similarity.
+        """
+        return self.search_many([query], top_k, content_type_filter, document_ids, hybrid)[0]
+
+    def search_many(self, queries, top_k=10, content_type_filter='all', document_ids=None, hybrid=False, query_vectors=None):
+        """Like search, but encodes and searches all queries in one batch. Returns one result list per query.
+
+        query_vectors, if given, are the queries already encoded by this database's embedder.
+        """
         if self.faiss_index is None or self.faiss_index.ntotal == 0:
             logging.warning("Search attempted but index is empty or not loaded.")
+            return [[] for _ in queries]
+        if not queries:
             return []
         try:
-            # Increase initial search size to account for filtering
-            search_k = top_k * 5 if content_type_filter != 'all' else top_k
-            search_k = min(search_k, self.faiss_index.ntotal)
-
-            query_vector = self.model.encode([query], convert_to_tensor=False).astype('float32')
-            distances, page_ids = self.faiss_index.search(query_vector, search_k)
-            
-            results = []
-            if page_ids.size == 0 or page_ids[0][0] == -1: return []
-
-            for i, page_id in enumerate(page_ids[0]):
-                if page_id == -1 or len(results) >= top_k: continue
-                page_id = int(page_id)
-                
-                page_info = self.page_map.get(page_id)
-                if not page_info: continue
-
-                # Apply the content type filter
-                if content_type_filter != 'all' and page_info.get('doc_type') != content_type_filter:
-                    continue
-
-                score = 1.0 / (1.0 + distances[0][i])
-                results.append({'page_id': page_id, **page_info, 'score': score, 'snippet': self._create_snippet(page_info.get('content', ''), query)})
-            return results
+            document_key = None if document_ids is None else tuple(sorted(int(d) for d in document_ids))
+            cache_keys = [(query, top_k, content_type_filter, document_key, hybrid, self.index_version) for query in queries]
+            cached = [self._search_results.get(key) for key in cache_keys]
+            pending = [i for i, results in enumerate(cached) if results is None]
+            if pending:
+                pending_vectors = None if query_vectors is None else np.asarray(query_vectors, dtype='float32')[pending]
+                fresh = self._search_uncached([queries[i] for i in pending], top_k, content_type_filter, document_ids, hybrid, pending_vectors)
+                for i, results in zip(pending, fresh):
+                    cached[i] = results
+                    self._search_results.put(cache_keys[i], results)
+            # Callers may annotate results, so hand out copies of the cached dicts.
+            return [[dict(result) for result in results] for results in cached]
         except Exception as e:
             logging.error(f"Error performing search: {e}", exc_info=True)
-            return []
-            
+            return [[] for _ in queries]
+
+    def _search_uncached(self, queries, top_k, content_type_filter, document_ids, hybrid, query_vectors=None):
+        if query_vectors is None: query_vectors = self.encode_queries(list(queries))
+        # Encoding and reading page text happen outside the lock; the rest sees one consistent index.
+        with self._index_lock.read():
+            all_results, lexical_snippets = self._rank(queries, query_vectors, top_k, content_type_filter, document_ids, hybrid)
+
+        # Page text is only read for the hits being returned.
+        contents = self._fetch_contents(list({r['page_id'] for results in all_results for r in results}))
+        for query, results, snippets in zip(queries, all_results, lexical_snippets):
+            for result in results:
+                result['content'] = contents.get(result['page_id'], '')
+                result['snippet'] = snippets.get(result['page_id']) or self._create_snippet(result['content'], query)
+        return all_results
+
+    def _rank(self, queries, query_vectors, top_k, content_type_filter, document_ids, hybrid):
+        doc_type = None if content_type_filter == 'all' else content_type_filter
+        allowed_ids = allowed_pages = None
+        if doc_type is not None or document_ids is not None:
+            allowed_pages = self.pages.select_ids(doc_type=doc_type, document_ids=document_ids)
+            # A duplicate group is searched through its canonical vector if any of its pages match.
+            allowed_ids = np.unique(self.pages.canonical_ids(allowed_pages))
+        depth = top_k * HYBRID_CANDIDATE_FACTOR if hybrid else top_k
+        search_k = min(depth, self.faiss_index.ntotal)
+        if search_k == 0:
+            # The index was swapped for an empty one after search_many checked it.
+            return [[] for _ in queries], [{} for _ in queries]
+        distances, page_ids = search_index(self.faiss_index, query_vectors, search_k, allowed_ids)
+
+        ranked_hits, lexical_snippets, fused_scores = [], [], []
+        for row, query in enumerate(queries):
+            hits = [(int(page_id), 1.0 / (1.0 + distance)) for page_id, distance in zip(page_ids[row], distances[row]) if page_id != -1]
+            snippets, fused = {}, None
+            if hybrid:
+                lexical = self.lexical_index.search(query, depth, doc_type, document_ids)
+                # Keyword hits are per page; duplicates are ranked as their canonical page, like vector hits.
+                lexical_ids = self.pages.canonical_ids([page_id for page_id, _, _ in lexical]).tolist()
+                fused = reciprocal_rank_fusion([[page_id for page_id, _ in hits], list(dict.fromkeys(lexical_ids))])
+                # Results keep the fused order, reported as 'fused_score', and also carry their vector
+                # similarity as 'score', on the same scale as a plain search; keyword-only hits are scored exactly.
+                similarities = dict(hits)
+                missing = np.array([page_id for page_id, _ in fused if page_id not in similarities], dtype=np.int64)
+                if len(missing):
+                    distances, labels = search_index(self.faiss_index, query_vectors[row:row + 1], len(missing), missing)
+                    similarities.update((int(page_id), 1.0 / (1.0 + distance)) for page_id, distance in zip(labels[0], distances[0]) if page_id != -1)
+                hits = [(page_id, similarities.get(page_id, 0.0)) for page_id, _ in fused]
+                for page_id, (_, _, snippet) in zip(lexical_ids, lexical): snippets.setdefault(page_id, snippet)
+                fused = dict(fused)
+            ranked_hits.append(hits)
+            lexical_snippets.append(snippets)
+            fused_scores.append(fused)
+
+        groups = self.pages.locations(sorted({page_id for hits in ranked_hits for page_id, _ in hits}))
+        members = np.array(sorted({page_id for group in groups.values() for page_id in group}), dtype=np.int64)
+        page_infos = self.pages.get_many(members)
+        allowed = None if allowed_pages is None else set(members[np.isin(members, allowed_pages)].tolist())
+        all_results, all_snippets = [], []
+        for hits, snippets, fused in zip(ranked_hits, lexical_snippets, fused_scores):
+            results, result_snippets = [], {}
+            for page_id, score in hits:
+                if len(results) >= top_k: break
+                locations = [member for member in groups[page_id] if member in page_infos]
+                # A group is shown as its canonical page, or the first of its pages that passes the filter.
+                shown = [member for member in locations if allowed is None or member in allowed]
+                if not shown: continue
+                results.append({'page_id': shown[0], **page_infos[shown[0]], 'score': score,
+                                'locations': [{'page_id': member, **page_infos[member]} for member in locations]})
+                if fused is not None: results[-1]['fused_score'] = fused[page_id]
+                if page_id in snippets: result_snippets[shown[0]] = snippets[page_id]
+            all_results.append(results)
+            all_snippets.append(result_snippets)
+        return all_results, all_snippets
+
+    def _page_metadata(self, page, text):
+        return {
+            'id': page.id, 'document_id': page.document.id, 'page_number': page.page_number,
+            'document_name': page.document.original_filename,
+            'doc_type': page.document.doc_type, 'start_time_seconds': page.start_time_seconds,
+            'text_hash': text_hash(text).hex(), 'shingle_hash': f"{shingle_hash(text):016x}",
+        }
+
+    def _fetch_contents(self, page_ids):
+        """Returns {page_id: ENHANCED_TEXT} for page_ids, read from library.db."""
+        if not page_ids or not os.path.exists(self.library_db_path):
+            return {}
+        try:
+            conn = sqlite3.connect(self.library_db_path)
+            try:
+                placeholders = ",".join("?" * len(page_ids))
+                rows = conn.execute(f"SELECT id, gemini_analysis FROM pdfpage WHERE id IN ({placeholders})", list(page_ids)).fetchall()
+            finally:
+                conn.close()
+            return {page_id: self._extract_section(analysis or '', "ENHANCED_TEXT") for page_id, analysis in rows}
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read page content from {self.library_db_path}: {e}")
+            return {}
+
     def _extract_section(self, text, section_name):
         try:
             start_tag = f"###{section_name}###"
@@ -197,21 +1225,165 @@ class VectorDatabase:
         snippet = text[start:start+length]
         return f"{'...' if start > 0 else ''}{snippet}{'...' if (start + length) < len(text) else ''}"
 
+    def index_file_paths(self):
+        """Files that together make up the persisted index, e.g. for syncing to Drive."""
+        return [self.faiss_index_path, self.page_meta_path, self.page_names_path, self.index_meta_path, self.delta_log.path, self.related_pages_path]
+
+    def _index_meta(self):
+        return {
+            'index_type': self.index_type, 'quantization': self.quantization, 'rescore': self.rescore,
+            'collapse_duplicates': self.collapse_duplicates, 'layout': list(index_layout(self.faiss_index)),
+            'embedder': self.embedder.backend, 'model_name': self.model_name, 'dimension': self.dimension,
+        }
+
+    def _read_index_meta(self):
+        if not os.path.exists(self.index_meta_path):
+            return {}
+        try:
+            with open(self.index_meta_path, 'r') as f: return json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            logging.warning(f"Could not read {self.index_meta_path}: {e}")
+            return {}
+
+    def _restore_mode(self, meta):
+        if self._requested_mode['index_type'] is None and meta.get('index_type') in INDEX_TYPES:
+            self.index_type = meta['index_type']
+        if self._requested_mode['quantization'] is None and meta.get('quantization') in QUANTIZATION_TYPES:
+            self.quantization = meta['quantization']
+        if self._requested_mode['rescore'] is None and 'rescore' in meta:
+            self.rescore = bool(meta['rescore'])
+        if self._requested_mode['collapse_duplicates'] is None and 'collapse_duplicates' in meta:
+            self.collapse_duplicates = bool(meta['collapse_duplicates'])
+        self.generation = int(meta.get('generation', 0))
+
+    def _snapshot_matches(self, meta):
+        """Returns whether the snapshot files are those index_meta.json was published with."""
+        for name, expected in meta.get('files', {}).items():
+            path = os.path.join(self.index_path_base, name)
+            if not os.path.exists(path) or os.path.getsize(path) != expected['size']:
+                matches = False
+            elif 'crc32' in expected:
+                matches = _file_crc32(path) == expected['crc32']
+            else:
+                matches = _file_stamp(path) == meta.get('generation')
+            if not matches:
+                logging.error(f"{path} does not belong to snapshot generation {meta.get('generation')}. Ignoring the snapshot.")
+                return False
+        return True
+
+    def _check_embedder(self, meta):
+        """Returns whether the saved index holds vectors of the current embedder, switching to the saved one if none was requested."""
+        if not meta:
+            return True
+        # Indexes saved before backends were recorded were all built with sentence-transformers.
+        saved = (meta.get('embedder', DEFAULT_EMBEDDER_BACKEND), meta.get('model_name', MODEL_NAME))
+        if self._requested_embedder is None and saved != (self.embedder.backend, self.model_name) and saved[0] in EMBEDDER_BACKENDS:
+            self._set_embedder(get_embedder(*saved))
+        if saved != (self.embedder.backend, self.model_name) or meta.get('dimension', self.dimension) != self.dimension:
+            logging.warning(f"Saved index was built with {saved[0]} embedder '{saved[1]}' ({meta.get('dimension')} dims), "
+                            f"not {self.embedder.backend} '{self.model_name}' ({self.dimension} dims). It must be rebuilt.")
+            return False
+        return True
+
+    def _replay_delta_log(self):
+        log_generation = self.delta_log.generation()
+        if log_generation is None:
+            return
+        if log_generation < self.generation:
+            # The snapshot was published but the log not yet reset; its records are already included.
+            self.delta_log.rebase(self.generation)
+            return
+        if log_generation > self.generation:
+            logging.warning(f"Delta log is newer (generation {log_generation}) than the snapshot ({self.generation}). Replaying it anyway.")
+        applied = 0
+        for record in self.delta_log.replay():
+            if record[0] == 'add':
+                _, ids, vectors, rows = record
+                self._add_pages(ids, vectors, rows)
+            else:
+                # Removals may also target vectors without a metadata row (see reconcile).
+                vector_ids = self.pages.vector_ids()
+                present = vector_ids if self.faiss_index.ntotal == len(vector_ids) else index_ids(self.faiss_index)
+                ids = record[1][np.isin(record[1], present)]
+                if len(ids): self._remove_ids(ids)
+                self.pages.remove(record[1])
+            applied += 1
+        if applied:
+            logging.info(f"Replayed {applied} delta log records. Index has {self.faiss_index.ntotal} vectors.")
+
     def save_index(self):
+        """Writes a full snapshot of the in-memory index and empties the delta log."""
         try:
-            faiss.write_index(self.faiss_index, self.faiss_index_path)
-            with open(self.page_map_path, 'wb') as f: pickle.dump(self.page_map, f)
+            with self._persist_lock:
+                self._drop_deleted()
+                self._write_snapshot(faiss.serialize_index(self.faiss_index), self.pages, self._index_meta(), self.generation)
             logging.info(f"Index with {self.faiss_index.ntotal} vectors saved to {self.index_path_base}")
         except Exception as e:
             logging.error(f"Error saving index: {e}", exc_info=True)
     def load_index(self):
-        if os.path.exists(self.faiss_index_path) and os.path.exists(self.page_map_path):
+        """Loads the saved index off to the side and swaps it in, so searches keep using the old one meanwhile."""
+        with self._persist_lock:
+            shadow = copy.copy(self)
+            consistent = shadow._load_index()
+            if not consistent and self.faiss_index is not None:
+                logging.warning(f"Keeping the index already loaded from {self.index_path_base} and saving it over the mismatched files.")
+                # Otherwise later changes would go to a delta log that the next load discards with those files.
+                self.save_index()
+                return
+            with self._index_lock.write():
+                # Every loaded attribute is replaced in one step; the locks and caches are shared anyway.
+                self.__dict__.update(shadow.__dict__)
+            if not consistent:
+                # The empty index replaces the mismatched snapshot, so the pages reconcile restores persist.
+                self.save_index()
+
+    def _read_faiss_index(self):
+        if self.memory_map:
+            try:
+                index = faiss.read_index(self.faiss_index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self._mapped = True
+                return index
+            except RuntimeError as e:
+                logging.warning(f"Could not memory-map {self.faiss_index_path} ({e}). Reading it into memory.")
+        return faiss.read_index(self.faiss_index_path)
+
+    def _load_index(self):
+        """Loads the saved snapshot and replays the delta log. Returns False if the snapshot files were mismatched."""
+        self.generation = 0
+        self._mapped = False
+        meta = self._read_index_meta()
+        self._restore_mode(meta)
+        self.neighbour_graph = NeighbourGraph(self.related_pages_path)
+        self.neighbour_graph.load()
+        has_pages = os.path.exists(self.page_meta_path) and os.path.exists(self.page_names_path)
+        with self.files_lock:
+            consistent = self._snapshot_matches(meta)
+        if not consistent:
+            # The delta log belongs to a snapshot that is gone; reconcile restores the pages from library.db.
+            self._initialize_faiss_index()
+            return False
+        if not self._check_embedder(meta):
+            # Saved at once, as the old snapshot's meta would make the next load discard every page added meanwhile.
+            self._initialize_faiss_index()
+            self.save_index()
+        elif os.path.exists(self.faiss_index_path) and (has_pages or os.path.exists(self.legacy_page_map_path)):
             try:
-                self.faiss_index = faiss.read_index(self.faiss_index_path)
-                with open(self.page_map_path, 'rb') as f: self.page_map = pickle.load(f)
-                logging.info(f"Index with {self.faiss_index.ntotal} vectors loaded from {self.index_path_base}.")
+                self.faiss_index = self._read_faiss_index()
+                configure_search(self.faiss_index)
+                if has_pages:
+                    self.pages = PageMetadataStore.load(self.page_meta_path, self.page_names_path, memory_map=self.memory_map)
+                else:
+                    with open(self.legacy_page_map_path, 'rb') as f: self.pages = PageMetadataStore.from_page_map(pickle.load(f))
+                logging.info(f"Index with {self.faiss_index.ntotal} vectors {'mapped' if self._mapped else 'loaded'} from {self.index_path_base}.")
             except Exception as e:
                 logging.error(f"Error loading index files: {e}. Re-initializing.")
+                self._mapped = False
                 self._initialize_faiss_index()
         else:
-            self._initialize_faiss_index()
\ No newline at end of file
+            self._initialize_faiss_index()
+        try:
+            self._replay_delta_log()
+        except Exception as e:
+            logging.error(f"Error replaying delta log: {e}", exc_info=True)
+        self._bump_index_version()
+        return True
\ No newline at end of file
@@ -1,5 +1,6 @@
 import logging
-from gemini_client import GeminiClient
+from gemini_client import GeminiClient, plan_analysis_batches
+from async_ingest import iterate_async, map_unordered
 import re
 
 gemini_client = GeminiClient()
@@ -26,14 +27,29 @@ class YouTubeProcessor:
             return 0
 
     def process_video(self, youtube_url, doc_id, api_key, original_filename):
+        """Yields {"status_text"} and {"page_data"} events while the video is analysed on the ingestion loop."""
+        return iterate_async(self.process_video_async(youtube_url, doc_id, api_key, original_filename))
+
+    def _parse_segment(self, segment_text):
+        # --- START OF MODIFICATION ---
+        # Use a more robust regex to find the timestamp line, then parse it.
+        time_match = re.search(r"Timestamp:\s*([\d:]+)", segment_text)
+        time_str = time_match.group(1) if time_match else "0"
+        total_seconds = self._parse_timestamp_to_seconds(time_str)
+        # --- END OF MODIFICATION ---
+        
+        content = re.sub(r"Timestamp:\s*[\d:]+\s*\n", "", segment_text).strip()
+        return total_seconds, content
+
+    async def process_video_async(self, youtube_url, doc_id, api_key, original_filename):
         try:
             logging.info(f"Starting Gemini analysis for YouTube URL: {youtube_url}")
             
-            full_analysis = gemini_client.analyze_youtube_video_for_indexing(youtube_url, api_key)
+            full_analysis = await gemini_client.analyze_youtube_video_for_indexing_async(youtube_url, api_key)
             
             if not full_analysis or "###SEGMENT###" not in full_analysis:
                 logging.error("Gemini analysis for video did not return valid segments.")
-                analysis_result = gemini_client.analyze_page_for_indexing(full_analysis, original_filename, api_key)
+                analysis_result = await gemini_client.analyze_page_for_indexing_async(full_analysis, original_filename, api_key)
                 yield {"page_data": {
                     'page_number': 1, 'start_time_seconds': 0, 'text_content': full_analysis,
                     'gemini_analysis': analysis_result
@@ -43,27 +59,30 @@ class YouTubeProcessor:
             segments = full_analysis.split("###SEGMENT###")[1:]
             total_segments = len(segments)
             yield {"status_text": f"Analyzing video segments (0/{total_segments})"}
-            
-            for i, segment_text in enumerate(segments):
-                yield {"status_text": f"Processing segment {i+1}/{total_segments}"}
-                
-                # --- START OF MODIFICATION ---
-                # Use a more robust regex to find the timestamp line, then parse it.
-                time_match = re.search(r"Timestamp:\s*([\d:]+)", segment_text)
-                time_str = time_match.group(1) if time_match else "0"
-                total_seconds = self._parse_timestamp_to_seconds(time_str)
-                # --- END OF MODIFICATION ---
-                
-                content = re.sub(r"Timestamp:\s*[\d:]+\s*\n", "", segment_text).strip()
-                
-                gemini_analysis_for_segment = gemini_client.analyze_page_for_indexing(content, original_filename, api_key)
 
-                yield {"page_data": {
-                    'page_number': i + 1, 
-                    'start_time_seconds': total_seconds, # Save the correctly calculated total seconds
-                    'text_content': content, 
-                    'gemini_analysis': gemini_analysis_for_segment
-                }}
+            parsed_segments = [self._parse_segment(segment_text) for segment_text in segments]
+
+            async def analyze_batch(batch):
+                return await gemini_client.analyze_pages_for_indexing_async([parsed_segments[i][1] for i in batch], original_filename, api_key)
+
+            # Segments are analysed several to a request, batches concurrently, and reported as they finish.
+            batches = plan_analysis_batches([content for _, content in parsed_segments])
+            processed_count = 0
+            async for batch, analyses, exc in map_unordered(analyze_batch, batches):
+                if exc is not None:
+                    logging.error(f'Segments {[i + 1 for i in batch]} generated an exception: {exc}')
+                    continue
+                for i, gemini_analysis_for_segment in zip(batch, analyses):
+                    total_seconds, content = parsed_segments[i]
+                    processed_count += 1
+                    yield {"status_text": f"Processing segment {processed_count}/{total_segments}"}
+
+                    yield {"page_data": {
+                        'page_number': i + 1, 
+                        'start_time_seconds': total_seconds, # Save the correctly calculated total seconds
+                        'text_content': content, 
+                        'gemini_analysis': gemini_analysis_for_segment
+                    }}
 
         except Exception as e:
             logging.error(f"Error processing YouTube video {youtube_url}: {str(e)}", exc_info=True)